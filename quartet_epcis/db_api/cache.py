@@ -0,0 +1,172 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# the attributes of an EPCPyYes template event that belong to its jinja
+# environment rather than to the event itself
+TEMPLATE_ATTRIBUTES = ("_env", "_template", "_context", "encoder")
+
+
+def freeze(event) -> bytes:
+    """
+    Serializes an EPCPyYes template event (minus its template machinery)
+    for storage in an event cache.
+    """
+    state = {
+        name: value
+        for name, value in vars(event).items()
+        if name not in TEMPLATE_ATTRIBUTES
+    }
+    return pickle.dumps((type(event), state), pickle.HIGHEST_PROTOCOL)
+
+
+def thaw(value: bytes):
+    """
+    Returns a new EPCPyYes template event from a value created by freeze.
+    """
+    event_class, state = pickle.loads(value)
+    event = event_class()
+    event.__dict__.update(state)
+    return event
+
+
+class LocalEventCache:
+    """
+    A bounded, least-recently-used, in-process cache of frozen events
+    keyed by Event primary key.  Safe to share between threads.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """
+        :param max_size: The number of events to hold before the least
+        recently used are evicted.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys) -> dict:
+        ret = {}
+        with self._lock:
+            for key in keys:
+                if key in self._values:
+                    self._values.move_to_end(key)
+                    ret[key] = self._values[key]
+            self.hits += len(ret)
+            self.misses += len(keys) - len(ret)
+        return ret
+
+    def set_many(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = value
+                self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class DjangoEventCache:
+    """
+    Stores frozen events in one of the caches in the Django CACHES
+    setting so that they can be shared between processes.  Clearing the
+    cache bumps a version number kept in the cache rather than clearing
+    the whole (possibly shared) backend.
+    """
+
+    prefix = "quartet_epcis.event"
+
+    def __init__(self, alias: str = "default", timeout: int = None):
+        """
+        :param alias: The name of the cache in the CACHES setting.
+        :param timeout: The number of seconds to keep events for.  None
+        to keep them until they are evicted by the backend.
+        """
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get_many(self, keys) -> dict:
+        version = self._version()
+        cache_keys = {self._key(key, version): key for key in keys}
+        values = self.cache.get_many(list(cache_keys))
+        return {cache_keys[cache_key]: value for cache_key, value in values.items()}
+
+    def set_many(self, values: dict):
+        version = self._version()
+        self.cache.set_many(
+            {self._key(key, version): value for key, value in values.items()},
+            timeout=self.timeout,
+        )
+
+    def delete_many(self, keys):
+        version = self._version()
+        self.cache.delete_many([self._key(key, version) for key in keys])
+
+    def clear(self):
+        try:
+            self.cache.incr("%s.version" % self.prefix)
+        except ValueError:
+            self.cache.set("%s.version" % self.prefix, 2, timeout=None)
+
+    def _version(self) -> int:
+        return self.cache.get_or_set("%s.version" % self.prefix, 1, timeout=None)
+
+    def _key(self, key, version: int) -> str:
+        return "%s.%s.%s" % (self.prefix, version, key)
+
+
+_event_cache = None
+_event_cache_setting = None
+
+
+def get_event_cache():
+    """
+    Returns the event cache configured by the QUARTET_EPCIS_EVENT_CACHE
+    setting or None if the events are not being cached (the default).
+    Set it to 'local' for a LocalEventCache holding
+    QUARTET_EPCIS_EVENT_CACHE_SIZE events (10000 by default) or to the
+    name of a cache in the CACHES setting for a DjangoEventCache.
+    """
+    global _event_cache, _event_cache_setting
+    setting = getattr(settings, "QUARTET_EPCIS_EVENT_CACHE", None)
+    if not setting:
+        return None
+    if setting != _event_cache_setting:
+        if setting == "local":
+            _event_cache = LocalEventCache(
+                getattr(settings, "QUARTET_EPCIS_EVENT_CACHE_SIZE", 10000)
+            )
+        else:
+            _event_cache = DjangoEventCache(setting)
+        _event_cache_setting = setting
+    return _event_cache
@@ -0,0 +1,268 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+"""
+Optional PostgreSQL range partitioning of the EntryEvent table by
+event_time.  EntryEvent holds a row for every EPC in every event so it is
+by far the largest table in the schema; partitioning it by time keeps each
+partition's indexes small, lets the planner skip partitions when a query
+is bounded by event_time and lets old data be removed by detaching a
+partition rather than deleting rows.
+
+Turned on by the QUARTET_EPCIS_PARTITION_EVENTS setting.  Each partition
+covers QUARTET_EPCIS_PARTITION_MONTHS months (1 by default).
+"""
+import logging
+import re
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+from quartet_epcis.models import entries
+
+logger = logging.getLogger(__name__)
+
+PARTITION_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def partitioning_enabled() -> bool:
+    """
+    Whether or not the EntryEvent table is (to be) partitioned by
+    event_time.  Controlled by the QUARTET_EPCIS_PARTITION_EVENTS setting.
+    Default is False.
+    """
+    return getattr(settings, "QUARTET_EPCIS_PARTITION_EVENTS", False)
+
+
+def partition_months() -> int:
+    """
+    The number of months each partition covers.  Controlled by the
+    QUARTET_EPCIS_PARTITION_MONTHS setting.  Default is 1.
+    """
+    return getattr(settings, "QUARTET_EPCIS_PARTITION_MONTHS", 1)
+
+
+def add_months(value: date, months: int) -> date:
+    """
+    Returns the first day of the month the given number of months after
+    the month of value.
+    """
+    month = value.year * 12 + value.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def get_partition_ranges(start: date, count: int, months: int = None) -> list:
+    """
+    Returns the (name, lower bound, upper bound) of count partitions
+    starting with the one holding the start date.  Partitions are aligned
+    to multiples of `months` months from January so the same ranges come
+    back no matter which date in a partition is passed in.
+    :param start: A date in the first partition.
+    :param count: The number of partitions.
+    :param months: The number of months in each partition.  Defaults to
+    the QUARTET_EPCIS_PARTITION_MONTHS setting.
+    """
+    months = months or partition_months()
+    lower = add_months(start, -((start.month - 1) % months))
+    ret = []
+    for i in range(count):
+        upper = add_months(lower, months)
+        ret.append(("%s_p%s" % (_table(), lower.strftime("%Y%m")), lower, upper))
+        lower = upper
+    return ret
+
+
+def is_partitioned(using: str = "default") -> bool:
+    """
+    Whether or not the EntryEvent table in the database is partitioned.
+    Always False for databases other than PostgreSQL.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [_table()],
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partitions(
+    start: date = None, count: int = 3, using: str = "default"
+) -> list:
+    """
+    Creates any of the count partitions from the one holding the start
+    date on that do not exist yet.  Run ahead of time (see the
+    create_event_partitions management command) so that new events never
+    land in the default partition.
+    :param start: A date in the first partition.  Defaults to today.
+    :param count: The number of partitions.
+    :return: The names of the partitions.
+    """
+    connection = connections[using]
+    names = []
+    with connection.cursor() as cursor:
+        for name, lower, upper in get_partition_ranges(
+            start or date.today(), count
+        ):
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS %s PARTITION OF %s "
+                "FOR VALUES FROM (%s) TO (%s)"
+                % (
+                    connection.ops.quote_name(name),
+                    connection.ops.quote_name(_table()),
+                    _timestamp(lower),
+                    _timestamp(upper),
+                )
+            )
+            names.append(name)
+    return names
+
+
+def detach_partitions(before: date, using: str = "default") -> list:
+    """
+    Detaches every partition holding only events from before the given
+    date.  The detached tables are left in place to be archived or
+    dropped.
+    :return: The names of the detached partitions.
+    """
+    connection = connections[using]
+    cutoff = datetime.combine(before, datetime.min.time(), timezone.utc)
+    detached = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [_table()],
+        )
+        for name, bound in cursor.fetchall():
+            match = PARTITION_BOUND.search(bound)
+            # the default partition has no bounds
+            if match and _parse_timestamp(match.group(1)) <= cutoff:
+                detached.append(name)
+        for name in detached:
+            logger.info("Detaching partition %s.", name)
+            cursor.execute(
+                "ALTER TABLE %s DETACH PARTITION %s"
+                % (
+                    connection.ops.quote_name(_table()),
+                    connection.ops.quote_name(name),
+                )
+            )
+    return detached
+
+
+def partition_table(months_ahead: int = 3, using: str = "default") -> bool:
+    """
+    Converts the EntryEvent table into a table partitioned by event_time.
+    The rows are copied into partitions covering everything from the
+    oldest event to months_ahead partitions past today along with a
+    default partition for anything outside of those.  The existing
+    indexes and foreign keys are recreated with their current names and
+    the primary key becomes (id, event_time) since PostgreSQL requires the
+    partition key in every unique constraint.
+
+    This rewrites the whole table; on an existing system run it (by way of
+    the migration or the create_event_partitions --convert command) during
+    a maintenance window.
+    :return: False if the database is not PostgreSQL or the table is
+    already partitioned.
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql" or is_partitioned(using):
+        return False
+    table = _table()
+    old_table = "%s_unpartitioned" % table
+    sequence = "%s_pid_seq" % table
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # the indexes and foreign keys to recreate on the new table
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+            "AND tablename = %s AND indexname NOT IN (SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('p', 'u'))",
+            [table, table],
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        if foreign_keys:
+            # run the table's deferred foreign key checks from earlier in
+            # the transaction now, it can not be dropped while they are
+            # pending
+            cursor.execute(
+                "SET CONSTRAINTS %s IMMEDIATE"
+                % ", ".join(qn(name) for name, definition in foreign_keys)
+            )
+        cursor.execute("SELECT min(event_time), max(id) FROM %s" % qn(table))
+        first_event_time, max_id = cursor.fetchone()
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (qn(table), qn(old_table)))
+        cursor.execute(
+            "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (event_time)" % (qn(table), qn(old_table))
+        )
+        # the old table's identity sequence goes with it
+        cursor.execute(
+            "CREATE SEQUENCE %s START WITH %s OWNED BY %s.id"
+            % (qn(sequence), (max_id or 0) + 1, qn(table))
+        )
+        cursor.execute(
+            "ALTER TABLE %s ALTER COLUMN id SET DEFAULT nextval('%s')"
+            % (qn(table), sequence)
+        )
+        start = (first_event_time or datetime.now(timezone.utc)).date()
+        today = date.today()
+        count = (
+            (today.year - start.year) * 12 + today.month - start.month
+        ) // partition_months() + months_ahead + 1
+        create_partitions(start, count, using)
+        cursor.execute(
+            "CREATE TABLE %s PARTITION OF %s DEFAULT"
+            % (qn("%s_default" % table), qn(table))
+        )
+        cursor.execute("INSERT INTO %s SELECT * FROM %s" % (qn(table), qn(old_table)))
+        cursor.execute("DROP TABLE %s" % qn(old_table))
+        cursor.execute(
+            "ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (id, event_time)"
+            % (qn(table), qn("%s_pkey" % table))
+        )
+        for index_definition in index_definitions:
+            cursor.execute(index_definition)
+        for name, definition in foreign_keys:
+            cursor.execute(
+                "ALTER TABLE %s ADD CONSTRAINT %s %s" % (qn(table), qn(name), definition)
+            )
+    return True
+
+
+def _table() -> str:
+    return entries.EntryEvent._meta.db_table
+
+
+def _timestamp(value: date) -> str:
+    return "'%s 00:00:00+00'" % value.isoformat()
+
+
+def _parse_timestamp(value: str) -> datetime:
+    # PostgreSQL writes whole hour offsets as +00
+    if re.search(r"[+-]\d\d$", value):
+        value += ":00"
+    return datetime.fromisoformat(value)
@@ -13,15 +13,29 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
+import base64
+import json
 import logging
+from datetime import datetime
 from typing import List
-from django.db.models import Q
+from django.conf import settings
+from django.db import connection
+from django.db.models import (
+    Exists,
+    Q,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    prefetch_related_objects,
+)
 from django.utils.translation import gettext as _
 from EPCPyYes.core.v1_2 import template_events, events as pyyes_events
 from EPCPyYes.core.v1_2.CBV.instance_lot_master_data import (
     InstanceLotMasterDataAttribute,
 )
 from EPCPyYes.core.SBDH import sbdh, template_sbdh
+from quartet_epcis.db_api.cache import get_event_cache, freeze, thaw
+from quartet_epcis.db_api.partitions import partitioning_enabled
 from quartet_epcis.models.choices import EventTypeChoicesEnum
 from quartet_epcis.models import events, entries, headers
 from quartet_epcis.parsing import errors
@@ -30,6 +44,76 @@ logger = logging.getLogger(__name__)
 
 EntryList = List[entries.Entry]
 
+# the related sets read when converting an Event to an EPCPyYes event
+EVENT_PREFETCH = (
+    "entryevent_set",
+    "transformationid_set",
+    "errordeclaration_set",
+    "quantityelement_set",
+    "businesstransaction_set",
+    "instancelotmasterdata_set",
+    "sourceevent_set__source",
+    "destinationevent_set__destination",
+)
+
+
+def entry_closure_enabled() -> bool:
+    """
+    Whether or not the EntryClosure table is being maintained and should be
+    used for hierarchy lookups.  Controlled by the
+    QUARTET_EPCIS_ENTRY_CLOSURE setting.  Default is False.
+    """
+    return getattr(settings, "QUARTET_EPCIS_ENTRY_CLOSURE", False)
+
+
+class EventPage(list):
+    """
+    A page of EPCPyYes events along with the opaque cursor to pass back in
+    for the next page.  The next_cursor is None on the last page.
+    """
+
+    def __init__(self, pevents: list, next_cursor: str = None):
+        super().__init__(pevents)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(event_time: datetime, event_id) -> str:
+    """
+    Encodes the event_time and primary key of the last event on a page
+    as an opaque cursor string.
+    """
+    value = json.dumps([event_time.isoformat(), str(event_id)])
+    return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Returns the (event_time, event primary key) tuple encoded in a cursor.
+    Raises a ValueError if the cursor is not valid.
+    """
+    try:
+        event_time, event_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(event_time), event_id
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor: %s" % cursor) from e
+
+
+def get_time_bounds(start_time: datetime = None, end_time: datetime = None) -> dict:
+    """
+    Returns the event_time filter arguments for an optional time range.
+    Bounding queries against the EntryEvent table by event_time lets
+    PostgreSQL skip the partitions outside of the range when the table is
+    partitioned (see quartet_epcis.db_api.partitions).
+    :param start_time: The earliest event_time to include.
+    :param end_time: The event_time to stop before.
+    """
+    bounds = {}
+    if start_time:
+        bounds["event_time__gte"] = start_time
+    if end_time:
+        bounds["event_time__lt"] = end_time
+    return bounds
+
 
 def get_sources(db_event: events.Event):
     """
@@ -68,6 +152,9 @@ class EPCISDBProxy:
     EPCPyYes objects.
     """
 
+    # the number of events whose related data is loaded at a time
+    event_batch_size = 1000
+
     def get_message_by_event_id(self, event_id: str, return_header=True):
         message_id = events.Event.objects.get(id=event_id).message_id
         message = headers.Message.objects.get(id=message_id)
@@ -84,26 +171,10 @@ class EPCISDBProxy:
         """
         document = template_events.EPCISDocument()
         if return_header:
-            try:
-                # first get the header if there was one
-                db_header = headers.SBDH.objects.get(message=message)
-                document.header = self._get_header(db_header)
-            except SBDH.DoesNotExist:
-                logger.debug(
-                    "There was no document header associated " "with message %s",
-                    message,
-                )
+            document.header = self.get_message_header(message)
         # now get the events
-        db_events = events.Event.objects.prefetch_related(
-            "transformationid_set",
-            "errordeclaration_set",
-            "quantityelement_set",
-            "businesstransaction_set",
-            "instancelotmasterdata_set",
-            "sourceevent_set__source",
-            "destinationevent_set__destination",
-        ).filter(message_id=message.id)
-        pevents = [self.get_epcis_event(db_event) for db_event in db_events]
+        db_events = events.Event.objects.filter(message_id=message.id)
+        pevents = self.get_epcis_events(db_events)
         for event in pevents:
             if isinstance(event, pyyes_events.TransformationEvent):
                 document.transformation_events.append(event)
@@ -115,6 +186,113 @@ class EPCISDBProxy:
                 document.aggregation_events.append(event)
         return document
 
+    def get_message_header(self, message: headers.Message):
+        """
+        Returns the header of the message as an EPCPyYes SBDH or None if
+        the message did not have one.
+        :param message: The Message model instance.
+        """
+        try:
+            db_header = headers.SBDH.objects.get(message=message)
+            return self._get_header(db_header)
+        except headers.SBDH.DoesNotExist:
+            logger.debug(
+                "There was no document header associated with message %s", message
+            )
+
+    def iter_message_events(self, message: headers.Message, chunk_size: int = None):
+        """
+        A streaming version of get_full_message.  Reads the events in the
+        message in event_time order using a server-side cursor (where the
+        database supports one) and yields them as EPCPyYes events,
+        converting chunk_size events at a time.  Transformation events are
+        yielded after all of the other events since they go in the
+        extension element of an EPCIS document.  Use along with one of
+        the writers in `quartet_epcis.db_api.writers`, for example:
+
+        .. code-block:: python
+
+            writer = EPCISDocumentWriter(proxy.get_message_header(message))
+            for text in writer.write(proxy.iter_message_events(message)):
+                output.write(text)
+
+        :param message: The Message model instance.
+        :param chunk_size: The number of events to read and convert at a
+        time.  Defaults to the event_batch_size.
+        :return: A generator of EPCPyYes template events.
+        """
+        db_events = events.Event.objects.filter(message_id=message.id)
+        return self.iter_document_events(db_events, chunk_size)
+
+    def iter_events_by_epc(
+        self,
+        epc: str = None,
+        epc_pk: str = None,
+        chunk_size: int = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+    ):
+        """
+        A streaming version of get_events_by_epc.  Yields each of the
+        events the epc was found in as an EPCPyYes event in event_time order
+        with any transformation events last.
+        :param epc: The epc to search events for.
+        :param epc_pk: The primary key of the epc to search events for.
+        :param chunk_size: The number of events to read and convert at a
+        time.  Defaults to the event_batch_size.
+        :param start_time: Only return events from this time on.
+        :param end_time: Only return events from before this time.
+        :return: A generator of EPCPyYes template events.
+        """
+        args = {"identifier": epc} if epc else {"id": epc_pk}
+        bounds = get_time_bounds(start_time, end_time)
+        db_events = events.Event.objects.filter(
+            id__in=entries.EntryEvent.objects.filter(**args, **bounds).values(
+                "event_id"
+            ),
+            **bounds,
+        )
+        return self.iter_document_events(db_events, chunk_size)
+
+    def iter_document_events(self, db_events, chunk_size: int = None):
+        """
+        Yields the events in the QuerySet as EPCPyYes events in the order
+        an EPCIS document needs them: all but the transformation events
+        in event_time order followed by the transformation events in
+        event_time order.
+        :param db_events: A QuerySet of Event model instances.
+        :param chunk_size: The number of events to read and convert at a
+        time.  Defaults to the event_batch_size.
+        :return: A generator of EPCPyYes template events.
+        """
+        db_events = db_events.order_by("event_time", "id")
+        transformation = EventTypeChoicesEnum.TRANSFORMATION.value
+        yield from self.iter_epcis_events(
+            db_events.exclude(type=transformation), chunk_size
+        )
+        yield from self.iter_epcis_events(
+            db_events.filter(type=transformation), chunk_size
+        )
+
+    def iter_epcis_events(self, db_events, chunk_size: int = None):
+        """
+        Iterates over a QuerySet of database events using a server-side
+        cursor (where the database supports one) and yields them as
+        EPCPyYes events, converting chunk_size events at a time.
+        :param db_events: A QuerySet of Event model instances.
+        :param chunk_size: The number of events to read and convert at a
+        time.  Defaults to the event_batch_size.
+        :return: A generator of EPCPyYes template events.
+        """
+        chunk_size = chunk_size or self.event_batch_size
+        chunk = []
+        for db_event in db_events.iterator(chunk_size=chunk_size):
+            chunk.append(db_event)
+            if len(chunk) >= chunk_size:
+                yield from self.get_epcis_events(chunk)
+                chunk = []
+        yield from self.get_epcis_events(chunk)
+
     def get_entries_by_parent_identifier(self, identifier: str, select_for_update=True):
         """
         Returns a QuerySet of entries based on the incoming identifier
@@ -137,65 +315,76 @@ class EPCISDBProxy:
             "identifier", flat=True
         )
 
-    def get_events_by_epc_list(self, epcs: list):
-        """
-        Returns a list of EPCPyEvents the epc was found in.
-        :param epc: The epc to search events for.
-        :param epc_pk: The primary key of the epc to search events for.
-        :return: A list of EPCPyEvents
+    def get_events_by_epc_list(
+        self, epcs: list, start_time: datetime = None, end_time: datetime = None
+    ):
         """
-        event_entries = (
-            entries.EntryEvent.objects.order_by("event__event_time")
-            .select_related("event")
-            .prefetch_related(
-                "event__transformationid_set",
-                "event__errordeclaration_set",
-                "event__quantityelement_set",
-                "event__businesstransaction_set",
-                "event__instancelotmasterdata_set",
-                "event__sourceevent_set__source",
-                "event__destinationevent_set__destination",
-            )
-            .filter(identifier__in=epcs)
-        )
-        return [
-            self.get_epcis_event(event_entry.event) for event_entry in event_entries
-        ]
+        Returns a list of the EPCPyEvents any of the epcs were found in.
+        Each event is returned once no matter how many of the epcs it has.
+        :param epcs: The epcs to search events for.
+        :param start_time: Only return events from this time on.
+        :param end_time: Only return events from before this time.
+        :return: A list of EPCPyEvents in event_time order.
+        """
+        bounds = get_time_bounds(start_time, end_time)
+        db_events = events.Event.objects.filter(
+            id__in=entries.EntryEvent.objects.filter(
+                identifier__in=epcs, **bounds
+            ).values("event_id"),
+            **bounds,
+        ).order_by("event_time", "id")
+        return self.get_epcis_events(db_events)
 
-    def get_events_by_epc(self, epc: str = None, epc_pk: str = None):
+    def get_events_by_epc(
+        self,
+        epc: str = None,
+        epc_pk: str = None,
+        page_size: int = None,
+        cursor: str = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+    ):
         """
         Returns a list of EPCPyEvents the epc was found in.
         :param epc: The epc to search events for.
         :param epc_pk: The primary key of the epc to search events for.
+        :param page_size: If supplied, only this many events are returned
+        as an EventPage.
+        :param cursor: The next_cursor of the previous EventPage.
+        :param start_time: Only return events from this time on.
+        :param end_time: Only return events from before this time.
         :return: A list of EPCPyEvents
         """
         args = {"identifier": epc} if epc else {"id": epc_pk}
+        args.update(get_time_bounds(start_time, end_time))
+        if page_size:
+            return self._get_event_page(
+                entries.EntryEvent.objects.filter(**args),
+                "event_id",
+                page_size,
+                cursor,
+            )
         event_entries = (
             entries.EntryEvent.objects.order_by("event__event_time")
             .select_related("event")
-            .prefetch_related(
-                "event__transformationid_set",
-                "event__errordeclaration_set",
-                "event__quantityelement_set",
-                "event__businesstransaction_set",
-                "event__instancelotmasterdata_set",
-                "event__sourceevent_set__source",
-                "event__destinationevent_set__destination",
-            )
             .filter(**args)
         )
-        return [
-            self.get_epcis_event(event_entry.event) for event_entry in event_entries
-        ]
+        return self.get_epcis_events(
+            [event_entry.event for event_entry in event_entries]
+        )
 
     def get_epcis_event(self, db_event: events.Event):
         """
         Takes the raw database event record and converts it to an EPCPyYes
-        event.
+        event.  The event is taken from the event cache if it is enabled
+        (see `quartet_epcis.db_api.cache.get_event_cache`) and has the event.
         :param db_event: The database event instance.
         :return: An EPCPyYes template event of type Object,
         Transformation, Transaction or Aggregation.
         """
+        return self.get_epcis_events([db_event])[0]
+
+    def _build_epcis_event(self, db_event: events.Event):
         # look up the type
         if db_event.type == EventTypeChoicesEnum.OBJECT.value:
             ret = self._get_object_event(db_event)
@@ -212,29 +401,129 @@ class EPCISDBProxy:
             ret.id = db_event.id
         return ret
 
-    def get_events_by_ilmd(self, name, value):
+    def get_epcis_events(self, db_events) -> list:
+        """
+        Converts a list or QuerySet of database events to EPCPyYes events.
+        The related data for the events is loaded with one query per
+        related table for each batch of event_batch_size events rather
+        than with several queries per event.
+        :param db_events: The database event instances.
+        :return: A list of EPCPyYes template events in the same order as
+        db_events.
+        """
+        db_events = list(db_events)
+        event_cache = get_event_cache()
+        cached = {}
+        if event_cache:
+            cached = event_cache.get_many({db_event.id for db_event in db_events})
+        built = iter(
+            self._build_epcis_events(
+                [db_event for db_event in db_events if db_event.id not in cached],
+                event_cache,
+            )
+        )
+        return [
+            thaw(cached[db_event.id]) if db_event.id in cached else next(built)
+            for db_event in db_events
+        ]
+
+    def _build_epcis_events(self, db_events: list, event_cache=None) -> list:
+        ret = []
+        for i in range(0, len(db_events), self.event_batch_size):
+            batch = db_events[i : i + self.event_batch_size]
+            prefetch_related_objects(batch, *self._get_event_prefetch(batch))
+            pevents = [self._build_epcis_event(db_event) for db_event in batch]
+            if event_cache:
+                event_cache.set_many(
+                    {
+                        db_event.id: freeze(pevent)
+                        for db_event, pevent in zip(batch, pevents)
+                        if pevent
+                    }
+                )
+            ret.extend(pevents)
+        return ret
+
+    def _get_event_prefetch(self, db_events: list) -> tuple:
+        """
+        Returns the EVENT_PREFETCH lookups for a batch of events.  When the
+        EntryEvent table is partitioned the EntryEvents are bounded by the
+        batch's event times so only the partitions holding them are read.
+        """
+        if not partitioning_enabled():
+            return EVENT_PREFETCH
+        event_times = [db_event.event_time for db_event in db_events]
+        return (
+            Prefetch(
+                "entryevent_set",
+                queryset=entries.EntryEvent.objects.filter(
+                    event_time__range=(min(event_times), max(event_times))
+                ),
+            ),
+        ) + tuple(lookup for lookup in EVENT_PREFETCH if lookup != "entryevent_set")
+
+    def _load_event_data(self, db_event: events.Event):
+        # does nothing if get_epcis_events has already loaded the data
+        prefetch_related_objects([db_event], *self._get_event_prefetch([db_event]))
+
+    def get_events_by_ilmd(self, name, value, page_size: int = None, cursor: str = None):
         """
         Returns a list of EPCPyYes events by ILMD name value pair.
-        Usefull for getting all events for a Lot, etc.
+        Usefull for getting all events for a Lot, etc.  Each event is
+        returned once in event_time order.
         :param name: The ILMD field name.
         :param value: The ILMD field value.
+        :param page_size: If supplied, only this many events are returned
+        as an EventPage.
+        :param cursor: The next_cursor of the previous EventPage.
         :return: A list of EPCPyYes template_event instances.
         """
-        ilmds = (
-            events.InstanceLotMasterData.objects.select_related("event")
-            .order_by("event__event_time")
-            .prefetch_related(
-                "event__transformationid_set",
-                "event__errordeclaration_set",
-                "event__quantityelement_set",
-                "event__businesstransaction_set",
-                "event__instancelotmasterdata_set",
-                "event__sourceevent_set__source",
-                "event__destinationevent_set__destination",
+        if page_size:
+            return self._get_event_page(
+                events.Event.objects.filter(
+                    instancelotmasterdata__name=name, instancelotmasterdata__value=value
+                ),
+                "id",
+                page_size,
+                cursor,
+            )
+        db_events = events.Event.objects.filter(
+            id__in=events.InstanceLotMasterData.objects.filter(
+                name=name, value=value
+            ).values("event_id")
+        ).order_by("event_time", "id")
+        return self.get_epcis_events(db_events)
+
+    def _get_event_page(self, queryset, event_field: str, page_size: int, cursor: str):
+        """
+        Returns an EventPage of up to page_size events ordered by
+        event_time and event primary key.  The cursor holds the key of the
+        last event on the previous page so each page is a range scan that
+        starts where the last one left off rather than an OFFSET.
+        :param queryset: A QuerySet of Events or of a model with an
+        event_time field and a reference to an Event.
+        :param event_field: The name of the queryset's field holding the
+        Event primary key.
+        :param page_size: The maximum number of events to return.
+        :param cursor: The next_cursor of the previous page or None.
+        """
+        queryset = queryset.order_by("event_time", event_field)
+        if cursor:
+            event_time, event_id = decode_cursor(cursor)
+            queryset = queryset.filter(event_time__gte=event_time).filter(
+                Q(event_time__gt=event_time) | Q(**{event_field + "__gt": event_id})
             )
-            .filter(name=name, value=value)
+        keys = list(queryset.values_list("event_time", event_field)[: page_size + 1])
+        next_cursor = None
+        if len(keys) > page_size:
+            keys = keys[:page_size]
+            next_cursor = encode_cursor(*keys[-1])
+        event_ids = list(dict.fromkeys(event_id for event_time, event_id in keys))
+        db_events = events.Event.objects.in_bulk(event_ids)
+        return EventPage(
+            self.get_epcis_events([db_events[event_id] for event_id in event_ids]),
+            next_cursor,
         )
-        return [self.get_epcis_event(ilmd.event) for ilmd in ilmds]
 
     def get_event_by_id(self, event_id: str):
         """
@@ -314,7 +603,9 @@ class EPCISDBProxy:
             partner = sbdh.Partner(
                 partner_type=sbdh.PartnerType(db_partner.partner_type)
             )
-            partner.partner_id = db_partner.identifier
+            partner.partner_id = sbdh.PartnerIdentification(
+                db_partner.authority, db_partner.identifier
+            )
             partner.contact_type_identifier = db_partner.contact_type_identifier
             partner.contact = db_partner.contact
             partner.telephone_number = db_partner.telephone_number
@@ -412,10 +703,7 @@ class EPCISDBProxy:
         :return: A list of EPCPyYes.core.v1_2.events.Source instances.
         """
         ret = []
-        se_list = events.SourceEvent.objects.select_related("source").filter(
-            event=db_event
-        )
-        for se in se_list:
+        for se in db_event.sourceevent_set.all():
             source = pyyes_events.Source(
                 source_type=se.source.type, source=se.source.source
             )
@@ -430,10 +718,7 @@ class EPCISDBProxy:
         :return: A list of EPCPyYes.core.v1_2.events.destination instances.
         """
         ret = []
-        dest_list = events.DestinationEvent.objects.select_related(
-            "destination"
-        ).filter(event=db_event)
-        for dest in dest_list:
+        for dest in db_event.destinationevent_set.all():
             destination = pyyes_events.Destination(
                 destination_type=dest.destination.type,
                 destination=dest.destination.destination,
@@ -447,13 +732,10 @@ class EPCISDBProxy:
         :param db_event: The event to retrieve the parent for.
         :return: A string representing the epc.
         """
-        try:
-            ee = entries.EntryEvent.objects.select_related("entry").get(
-                event=db_event, is_parent=True
-            )
-            return ee.entry.identifier
-        except entries.EntryEvent.DoesNotExist:
-            logger.info("No parent for event %s", db_event.id)
+        for ee in db_event.entryevent_set.all():
+            if ee.is_parent:
+                return ee.identifier
+        logger.info("No parent for event %s", db_event.id)
 
     def get_epc_list(self, db_event: events.Event, is_parent=False, output=False):
         """
@@ -465,10 +747,11 @@ class EPCISDBProxy:
         for use with transformation events.
         :return: A list of EPCs.
         """
-        ee = entries.EntryEvent.objects.select_related("entry").filter(
-            event=db_event, is_parent=is_parent, output=output
-        )
-        return [e.entry.identifier for e in ee]
+        return [
+            ee.identifier
+            for ee in db_event.entryevent_set.all()
+            if ee.is_parent == is_parent and ee.output == output
+        ]
 
     def get_input_epc_list(self, db_event: events.Event):
         """
@@ -495,10 +778,10 @@ class EPCISDBProxy:
         :param db_event: The Event go get the quantity data for.
         :return:
         """
-        qes = events.QuantityElement.objects.filter(event=db_event, is_output=is_output)
         return [
             pyyes_events.QuantityElement(qe.epc_class, quantity=qe.quantity, uom=qe.uom)
-            for qe in qes
+            for qe in db_event.quantityelement_set.all()
+            if qe.is_output == is_output
         ]
 
     def get_ilmd(self, db_event: events.Event):
@@ -508,10 +791,9 @@ class EPCISDBProxy:
         :param db_event: The event to find ILMD data for.
         :return: A list of EPCPyYes ILMD class instances.
         """
-        ilmds = events.InstanceLotMasterData.objects.filter(event=db_event)
         return [
             InstanceLotMasterDataAttribute(name=ilmd.name, value=ilmd.value)
-            for ilmd in ilmds
+            for ilmd in db_event.instancelotmasterdata_set.all()
         ]
 
     def _get_object_event(self, db_event: events.Event):
@@ -521,6 +803,7 @@ class EPCISDBProxy:
         :param db_event: The object event event.Event instance.
         :return: An EPCPyYes template event ObjectEvent.
         """
+        self._load_event_data(db_event)
         o_event = template_events.ObjectEvent()
         self.get_business_event(db_event, o_event)
         o_event.epc_list = self.get_epc_list(db_event)
@@ -535,6 +818,7 @@ class EPCISDBProxy:
         :param db_event: The aggregation event event.Event instance.
         :return: An EPCPyYes template event AggregationEvent.
         """
+        self._load_event_data(db_event)
         agg_event = template_events.AggregationEvent()
         self.get_business_event(db_event, agg_event)
         agg_event.child_quantity_list = self.get_quantity_list(db_event)
@@ -549,6 +833,7 @@ class EPCISDBProxy:
         :param db_event: The transaction event event.Event instance.
         :return: An EPCPyYes template event TransactionEvent.
         """
+        self._load_event_data(db_event)
         xact_event = template_events.TransactionEvent()
         self.get_business_event(db_event, xact_event)
         xact_event.epc_list = self.get_epc_list(db_event)
@@ -564,6 +849,7 @@ class EPCISDBProxy:
         of the database.
         :return: An EPCPyYes template_event TransformationEvent.
         """
+        self._load_event_data(db_event)
         xform_event = template_events.TransformationEvent()
         # get the basic EPCISEvent values
         self.get_base_epcis_event(db_event, xform_event)
@@ -591,11 +877,9 @@ class EPCISDBProxy:
         :param db_event: The Event model instance to use for the lookup.
         :return: The transformation id as a string.
         """
-        try:
-            tid = events.TransformationID.objects.get(event=db_event)
+        for tid in db_event.transformationid_set.all():
             return tid.identifier
-        except events.TransformationID.DoesNotExist:
-            logger.debug("No transformation id was found for event %s", db_event.id)
+        logger.debug("No transformation id was found for event %s", db_event.id)
 
     def get_entries_by_parent(
         self, parent_entry: entries.Entry, select_for_update=True
@@ -666,6 +950,334 @@ class EPCISDBProxy:
             func = entries.Entry.objects.filter
         return func
 
+    def get_descendant_entries(self, entry_ids: list) -> list:
+        """
+        Returns every Entry that sits anywhere beneath the given entries
+        in the hierarchy using a single recursive query over parent_id
+        (per 500 root entries).  Decommissioned entries, and anything
+        beneath them, are not included.
+        :param entry_ids: The primary keys of the root entries.
+        :return: A list of (id, identifier) tuples.
+        """
+        ret = []
+        for cte, params in self._descendants_cte(entry_ids):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "%s SELECT e.id, e.identifier FROM %s e "
+                    "WHERE e.id IN (SELECT id FROM descendants)"
+                    % (cte, self._entry_table()),
+                    params,
+                )
+                ret += cursor.fetchall()
+        pk = entries.Entry._meta.pk
+        return [
+            (pk.to_python(entry_id), identifier) for entry_id, identifier in ret
+        ]
+
+    def update_descendant_entries(self, entry_ids: list, **values):
+        """
+        Updates every Entry beneath the given entries in the hierarchy with
+        a single UPDATE statement (per 500 root entries).
+        :param entry_ids: The primary keys of the root entries.
+        :param values: Entry field names and the values to set.
+        """
+        columns = []
+        column_params = []
+        for name, value in values.items():
+            field = entries.Entry._meta.get_field(name)
+            if field.is_relation and value is not None:
+                value = value.pk
+            columns.append("%s = %%s" % connection.ops.quote_name(field.column))
+            column_params.append(field.get_db_prep_save(value, connection))
+        for cte, params in self._descendants_cte(entry_ids):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "%s UPDATE %s SET %s WHERE id IN (SELECT id FROM descendants)"
+                    % (cte, self._entry_table(), ", ".join(columns)),
+                    params + column_params,
+                )
+
+    def propagate_to_descendants(self, entry_ids: list, fields: list):
+        """
+        Copies the values of the fields from each of the given entries to
+        every Entry beneath it with a single joined UPDATE statement (per
+        500 root entries).  If one of the given entries is beneath another, its
+        descendants take its values rather than the values of the higher
+        entry.
+        :param entry_ids: The primary keys of the entries to copy from.
+        :param fields: The names of the Entry fields to copy.
+        """
+        table = self._entry_table()
+        columns = [
+            connection.ops.quote_name(entries.Entry._meta.get_field(name).column)
+            for name in fields
+        ]
+        for cte, params in self._descendants_cte(entry_ids):
+            with connection.cursor() as cursor:
+                if self._supports_update_from():
+                    cursor.execute(
+                        "%s UPDATE %s SET %s FROM descendants d "
+                        "JOIN %s s ON s.id = d.root_id WHERE %s.id = d.id"
+                        % (
+                            cte,
+                            table,
+                            ", ".join(
+                                "%s = s.%s" % (column, column) for column in columns
+                            ),
+                            table,
+                            table,
+                        ),
+                        params,
+                    )
+                else:
+                    cursor.execute(
+                        "%s SELECT %s, d.id FROM descendants d "
+                        "JOIN %s s ON s.id = d.root_id"
+                        % (
+                            cte,
+                            ", ".join("s.%s" % column for column in columns),
+                            table,
+                        ),
+                        params,
+                    )
+                    cursor.executemany(
+                        "UPDATE %s SET %s WHERE id = %%s"
+                        % (
+                            table,
+                            ", ".join("%s = %%s" % column for column in columns),
+                        ),
+                        cursor.fetchall(),
+                    )
+
+    def _supports_update_from(self) -> bool:
+        # SQLite only supports UPDATE ... FROM from version 3.33 on
+        if connection.vendor == "sqlite":
+            return connection.Database.sqlite_version_info >= (3, 33)
+        return True
+
+    def update_entries_from_tops(self, tops: EntryList, fields: list) -> int:
+        """
+        Copies the values of the fields from each top level entry to every
+        entry that has it as its top_id in a single UPDATE statement.
+        :param tops: The top level Entry instances.
+        :param fields: The names of the Entry fields to copy.
+        :return: The number of rows updated.
+        """
+        top = entries.Entry.objects.filter(pk=OuterRef("top_id"))
+        return entries.Entry.objects.filter(
+            top_id__in=tops, decommissioned=False
+        ).update(**{name: Subquery(top.values(name)[:1]) for name in fields})
+
+    def _entry_table(self):
+        return connection.ops.quote_name(entries.Entry._meta.db_table)
+
+    def _descendants_cte(self, entry_ids: list, chunk_size: int = 500):
+        """
+        Yields the SQL and parameters for a recursive common table
+        expression named descendants.  It holds the id of each
+        non-decommissioned entry beneath each chunk of entry_ids along with
+        the root_id of the nearest of the entry_ids above it.  The entry_ids
+        themselves are never included.
+        """
+        table = self._entry_table()
+        parent = connection.ops.quote_name(
+            entries.Entry._meta.get_field("parent_id").column
+        )
+        pk = entries.Entry._meta.pk
+        entry_ids = [pk.get_db_prep_value(entry_id, connection) for entry_id in entry_ids]
+        for i in range(0, len(entry_ids), chunk_size):
+            chunk = entry_ids[i : i + chunk_size]
+            roots = ", ".join(["%s"] * len(chunk))
+            sql = (
+                "WITH RECURSIVE descendants (id, root_id) AS ("
+                "SELECT c.id, c.{parent} FROM {table} c "
+                "WHERE c.{parent} IN ({roots}) AND c.id NOT IN ({roots}) "
+                "AND c.decommissioned = %s "
+                "UNION "
+                "SELECT c.id, d.root_id FROM {table} c "
+                "JOIN descendants d ON c.{parent} = d.id "
+                "WHERE c.id NOT IN ({roots}) AND c.decommissioned = %s)"
+            ).format(table=table, parent=parent, roots=roots)
+            yield sql, chunk + chunk + [False] + chunk + [False]
+
+    def get_descendants(self, parent_entries: EntryList, select_for_update=False):
+        """
+        Returns everything inside the parent entries at any depth (but not
+        the parents themselves).  Uses the EntryClosure table if it is
+        enabled and a recursive query otherwise.
+        :param parent_entries: The Entry instances to look beneath.
+        :param select_for_update: Whether or not the returned QuerySet contains
+        model instances selected for update by the database.
+        :return: A QuerySet of Entry instances.
+        """
+        func = self._update_or_filter(select_for_update)
+        if entry_closure_enabled():
+            closures = entries.EntryClosure.objects.filter(
+                ancestor__in=parent_entries
+            ).values("descendant")
+            return func(id__in=closures, decommissioned=False)
+        ids = [
+            entry_id
+            for entry_id, identifier in self.get_descendant_entries(
+                [entry.pk for entry in parent_entries]
+            )
+        ]
+        return func(id__in=ids, decommissioned=False)
+
+    def get_ancestors(self, entry: entries.Entry) -> EntryList:
+        """
+        Returns the entries above the given entry, starting with its
+        parent and ending with its top.  Uses the EntryClosure table if it
+        is enabled and follows the parent_id of each entry otherwise.
+        :param entry: The Entry to find the ancestors of.
+        :return: A list of Entry instances.
+        """
+        if entry_closure_enabled():
+            return [
+                closure.ancestor
+                for closure in entries.EntryClosure.objects.filter(descendant=entry)
+                .select_related("ancestor")
+                .order_by("depth")
+            ]
+        ret = []
+        while entry.parent_id_id:
+            entry = entry.parent_id
+            ret.append(entry)
+        return ret
+
+    def add_to_closure(self, parent: entries.Entry, children: EntryList):
+        """
+        Records the children (and everything already inside them) as being
+        beneath the parent and each of the parent's ancestors in the
+        EntryClosure table.
+        :param parent: The Entry the children were packed into.
+        :param children: The Entry instances that were packed.
+        """
+        closure = entries.EntryClosure.objects
+        ancestors = [(parent.pk, 0)] + list(
+            closure.filter(descendant=parent).values_list("ancestor_id", "depth")
+        )
+        child_ids = [child.pk for child in children]
+        subtree = [(child_id, 0) for child_id in child_ids] + list(
+            closure.filter(ancestor_id__in=child_ids).values_list(
+                "descendant_id", "depth"
+            )
+        )
+        closure.bulk_create(
+            [
+                entries.EntryClosure(
+                    ancestor_id=ancestor_id,
+                    descendant_id=descendant_id,
+                    depth=ancestor_depth + descendant_depth + 1,
+                )
+                for ancestor_id, ancestor_depth in ancestors
+                for descendant_id, descendant_depth in subtree
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def remove_from_closure(self, parent: entries.Entry, children: EntryList = None):
+        """
+        Removes the children (and everything inside them) from beneath the
+        parent and each of its ancestors in the EntryClosure table.
+        :param parent: The Entry the children were unpacked from.
+        :param children: The Entry instances that were unpacked.  If None
+        then everything is unpacked from the parent.
+        """
+        closure = entries.EntryClosure.objects
+        ancestor_ids = [parent.pk] + list(
+            closure.filter(descendant=parent).values_list("ancestor_id", flat=True)
+        )
+        if children is None:
+            nodes = closure.filter(ancestor=parent).values_list(
+                "descendant_id", flat=True
+            )
+        else:
+            child_ids = [child.pk for child in children]
+            nodes = child_ids + list(
+                closure.filter(ancestor_id__in=child_ids).values_list(
+                    "descendant_id", flat=True
+                )
+            )
+        closure.filter(
+            ancestor_id__in=ancestor_ids, descendant_id__in=list(nodes)
+        ).delete()
+
+    def rebuild_closure(self) -> int:
+        """
+        Clears out the EntryClosure table and rebuilds it from the parent_id
+        of every Entry with a single recursive query.  Used to populate the
+        table when it is first enabled.
+        :return: The number of closure records.
+        """
+        closure = entries.EntryClosure
+        closure.objects.all().delete()
+        entry_table = self._entry_table()
+        parent = connection.ops.quote_name(
+            entries.Entry._meta.get_field("parent_id").column
+        )
+        sql = (
+            "WITH RECURSIVE ancestry (descendant_id, ancestor_id, depth) AS ("
+            "SELECT c.id, p.id, 1 FROM {entry} c "
+            "JOIN {entry} p ON p.id = c.{parent} "
+            "WHERE c.decommissioned = %s AND p.decommissioned = %s "
+            "UNION ALL "
+            "SELECT a.descendant_id, p.id, a.depth + 1 FROM ancestry a "
+            "JOIN {entry} e ON e.id = a.ancestor_id "
+            "JOIN {entry} p ON p.id = e.{parent} "
+            "WHERE p.decommissioned = %s) "
+            "INSERT INTO {closure} ({ancestor}, {descendant}, {depth}) "
+            "SELECT ancestor_id, descendant_id, depth FROM ancestry"
+        ).format(
+            entry=entry_table,
+            parent=parent,
+            closure=connection.ops.quote_name(closure._meta.db_table),
+            ancestor=connection.ops.quote_name(
+                closure._meta.get_field("ancestor").column
+            ),
+            descendant=connection.ops.quote_name(
+                closure._meta.get_field("descendant").column
+            ),
+            depth=connection.ops.quote_name("depth"),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [False, False, False])
+        return closure.objects.count()
+
+    def remove_entries_from_closure(self, db_entries: EntryList, recursive=True):
+        """
+        Removes decommissioned entries from the EntryClosure table.
+        :param db_entries: The decommissioned Entry instances.
+        :param recursive: Whether or not everything inside the entries was
+        decommissioned along with them.
+        """
+        closure = entries.EntryClosure.objects
+        entry_ids = [entry.pk for entry in db_entries]
+        if recursive:
+            entry_ids += list(
+                closure.filter(ancestor_id__in=entry_ids).values_list(
+                    "descendant_id", flat=True
+                )
+            )
+        else:
+            # what is left inside an entry is no longer reachable from
+            # above it: remove the rows that pass through the entry
+            closure.filter(
+                Exists(
+                    closure.filter(
+                        ancestor_id=OuterRef("ancestor_id"),
+                        descendant_id__in=entry_ids,
+                        descendant__closure_descendants__descendant_id=OuterRef(
+                            "descendant_id"
+                        ),
+                    )
+                )
+            ).delete()
+        closure.filter(
+            Q(ancestor_id__in=entry_ids) | Q(descendant_id__in=entry_ids)
+        ).delete()
+
     def get_entries_by_parents(self, parents: EntryList, select_for_update=True):
         """
         Returns a list of entries that are children if the inbound parent
@@ -735,6 +1347,57 @@ class EPCISDBProxy:
         func = self._update_or_filter(select_for_update)
         return func(identifier__in=epcs, decommissioned=False)
 
+    def iter_entry_statuses(self, epcs: list, chunk_size: int = 2000):
+        """
+        Yields a dictionary with the status of each of the epcs.  The
+        statuses are read with a single query that joins each entry's
+        parent and top.  The statuses of the epcs that were found are
+        yielded first followed by those that were not (which have a
+        commissioned value of False).
+        :param epcs: The epcs (Entry identifiers) to look up.
+        :param chunk_size: The number of rows to fetch from the database
+        at a time.
+        :return: A generator of dictionaries with identifier,
+        commissioned, decommissioned, last_disposition, last_event_time,
+        parent_id and top_id (the parent and top identifiers) keys.
+        """
+        remaining = set(epcs)
+        rows = (
+            entries.Entry.objects.filter(identifier__in=remaining)
+            .order_by()
+            .values_list(
+                "identifier",
+                "decommissioned",
+                "last_disposition",
+                "last_event_time",
+                "parent_id__identifier",
+                "top_id__identifier",
+            )
+        )
+        for row in rows.iterator(chunk_size=chunk_size):
+            remaining.discard(row[0])
+            yield {
+                "identifier": row[0],
+                "commissioned": True,
+                "decommissioned": row[1],
+                "last_disposition": row[2],
+                "last_event_time": row[3],
+                "parent_id": row[4],
+                "top_id": row[5],
+            }
+        for epc in epcs:
+            if epc in remaining:
+                remaining.discard(epc)
+                yield {
+                    "identifier": epc,
+                    "commissioned": False,
+                    "decommissioned": False,
+                    "last_disposition": None,
+                    "last_event_time": None,
+                    "parent_id": None,
+                    "top_id": None,
+                }
+
     def get_entries_by_event(self, db_event: events.Event):
         """
         Returns a list all of the entries (serial numbers) for each event.
@@ -770,7 +1433,7 @@ class EPCISDBProxy:
         db_events = events.Event.objects.filter(id__in=db_entry_events).order_by(
             "event_time"
         )
-        return [self.get_epcis_event(db_event) for db_event in db_events]
+        return self.get_epcis_events(db_events)
 
     def get_events_by_entry_identifer(self, entry_identifier: str):
         """
@@ -810,23 +1473,32 @@ class EPCISDBProxy:
         # first get the entries
         collected_entries = {}
         db_entries = self.get_entries_by_epcs(epcs, select_for_update=False)
-        for db_entry in db_entries:
-            # add this to the collection...
-            # if there is no top_id and it is a parent that means it's a top
-            lower_entries = self.get_entry_child_parents(
-                db_entry, select_for_update=False
-            )
-            collected_entries[db_entry.identifier] = db_entry
-
-            for lower_entry in lower_entries:
-                # add the children to the connection
+        if entry_closure_enabled():
+            db_entries = list(db_entries)
+            for db_entry in db_entries:
+                collected_entries[db_entry.identifier] = db_entry
+            for lower_entry in self.get_descendants(db_entries).filter(
+                is_parent=True
+            ):
                 collected_entries[lower_entry.identifier] = lower_entry
-                # recursively call this function for the lower entry is also
-                # a parent
-                if lower_entry.is_parent:
-                    child_entries = self.get_aggregation_parents_by_epcs([lower_entry])
-                    # merge the dictionaries
-                    collected_entries = {**collected_entries, **child_entries}
+            return collected_entries
+        # walk down the hierarchy a level at a time fetching the parents
+        # on each level for all of the parents above them at once
+        level = list(db_entries)
+        for db_entry in level:
+            collected_entries[db_entry.identifier] = db_entry
+        while level:
+            parent_ids = [db_entry.pk for db_entry in level]
+            level = []
+            for i in range(0, len(parent_ids), 500):
+                for lower_entry in entries.Entry.objects.filter(
+                    parent_id__in=parent_ids[i : i + 500],
+                    is_parent=True,
+                    decommissioned=False,
+                ):
+                    if lower_entry.identifier not in collected_entries:
+                        collected_entries[lower_entry.identifier] = lower_entry
+                        level.append(lower_entry)
         return collected_entries
 
     def get_aggregation_events_by_epcs(self, epcs: list):
@@ -838,7 +1510,6 @@ class EPCISDBProxy:
         :param eps: The list of parents.
         :return: A list of EPCPyYes template_event AggregationEvent instances.
         """
-        ret = []
         top_entries = self.get_aggregation_parents_by_epcs(epcs)
         # now that we have a comprehensive list of parent entries,
         # we can get all of the aggregation events associated
@@ -853,9 +1524,7 @@ class EPCISDBProxy:
             .distinct()
         )
         db_events = events.Event.objects.filter(id__in=db_events).order_by("event_time")
-        for db_event in db_events:
-            ret.append(self._get_aggregation_event(db_event))
-        return ret
+        return self.get_epcis_events(db_events)
 
     def get_object_events_by_epcs(self, epcs: list, select_for_update=True):
         """
@@ -866,7 +1535,6 @@ class EPCISDBProxy:
         :param eps: The list of parents.
         :return: A list of EPCPyYes template_event AggregationEvent instances.
         """
-        ret = []
         db_entries = self.get_entries_by_epcs(epcs, select_for_update=select_for_update)
         db_events = (
             entries.EntryEvent.objects.select_related("event")
@@ -878,9 +1546,7 @@ class EPCISDBProxy:
             .distinct()
         )
         db_events = events.Event.objects.filter(id__in=db_events).order_by("event_time")
-        for db_event in db_events:
-            ret.append(self._get_object_event(db_event))
-        return ret
+        return self.get_epcis_events(db_events)
 
     def _get_event_entries(self, db_event: events.Event):
         """
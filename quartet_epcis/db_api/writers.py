@@ -0,0 +1,107 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import json
+from typing import Iterable, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from EPCPyYes.core.v1_2 import template_events, json_encoders
+from EPCPyYes.core.SBDH import template_sbdh
+
+
+class EPCISDocumentWriter:
+    """
+    Writes an EPCIS document a piece at a time: the opening of the
+    document and its header, then each event as it is handed over and
+    finally the end of the document.  Used along with
+    `EPCISDBProxy.iter_message_events` to export large messages without
+    holding every event in memory.
+
+    Transformation events belong in the EventList's extension element so
+    they must be written after all of the other events.
+    """
+
+    def __init__(
+        self,
+        header: template_sbdh.StandardBusinessDocumentHeader = None,
+        created_date: str = None,
+    ):
+        """
+        :param header: An optional EPCPyYes SBDH for the document.
+        :param created_date: The document's creationDate.  Defaults to the
+        current UTC time.
+        """
+        self.header = header
+        self.created_date = created_date
+
+    def write(self, pevents: Iterable) -> Iterator[str]:
+        """
+        Yields the document as a series of strings.
+        :param pevents: An iterable of EPCPyYes template events with any
+        transformation events at the end.
+        """
+        head, tail = self._render_document().split("</EventList>")
+        yield head
+        in_extension = False
+        for event in pevents:
+            if isinstance(event, template_events.TransformationEvent):
+                if not in_extension:
+                    in_extension = True
+                    yield "<extension>"
+            elif in_extension:
+                raise ValueError(
+                    "Transformation events must come after all of the other "
+                    "events in the document."
+                )
+            yield event.render()
+        if in_extension:
+            yield "</extension>"
+        yield "</EventList>" + tail
+
+    def _render_document(self) -> str:
+        # render the document without any events to get the text that
+        # goes before and after them
+        return template_events.EPCISDocument(
+            header=self.header,
+            object_events=[],
+            aggregation_events=[],
+            transaction_events=[],
+            transformation_events=[],
+            created_date=self.created_date,
+        ).render()
+
+
+class EPCISJSONDocumentWriter(EPCISDocumentWriter):
+    """
+    Writes the same JSON structure as the EPCPyYes EPCISDocumentEncoder
+    a piece at a time.
+    """
+
+    def write(self, pevents: Iterable) -> Iterator[str]:
+        document = template_events.EPCISDocument(
+            header=self.header, created_date=self.created_date
+        )
+        yield "{"
+        if self.header:
+            header = json_encoders.StandardBusinessDocumentHeaderEncoder()
+            yield '"header": %s, ' % self._dumps(header.default(self.header))
+        yield '"events": ['
+        for i, event in enumerate(pevents):
+            yield (", " if i else "") + self._dumps(event.render_dict())
+        yield '], "createdDate": %s}' % self._dumps(
+            document.encoder.get_date(document.created_date)
+        )
+
+    def _dumps(self, value) -> str:
+        return json.dumps(value, cls=DjangoJSONEncoder)
@@ -13,8 +13,13 @@
 #
 # Copyright 2020 SerialLab Corp.  All rights reserved.
 import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
 from gs123.conversion import BarcodeConverter
 from quartet_masterdata.db import DBProxy
+from quartet_masterdata.models import TradeItem
 from gs123.regex import SGTIN_SN_10_13_ALPHA
 from rest_framework.filters import SearchFilter
 from logging import getLogger
@@ -23,6 +28,141 @@ logger = getLogger(__name__)
 
 proxy = DBProxy()
 
+_missing = object()
+
+
+class CompanyPrefixCache:
+    """
+    A bounded cache of GTIN 14 to company prefix length lookups.  Entries
+    expire after `ttl` seconds so that master data changes are picked up
+    and the least recently used entries are evicted once `max_size` is
+    reached.  Safe to share between threads.
+    """
+
+    def __init__(self, ttl: int = 300, max_size: int = 10000):
+        """
+        :param ttl: The number of seconds a company prefix length is kept.
+        :param max_size: The number of GTINs to hold before the least
+        recently used are evicted.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, gtin14: str):
+        """
+        Returns the cached company prefix length for the GTIN or the
+        module's `_missing` sentinel if it is not cached (None is a valid,
+        cached, "unknown GTIN" value).
+        """
+        with self._lock:
+            value = self._values.get(gtin14)
+            if value and value[1] > time.monotonic():
+                self._values.move_to_end(gtin14)
+                self.hits += 1
+                return value[0]
+            self._values.pop(gtin14, None)
+            self.misses += 1
+            return _missing
+
+    def set_many(self, values: dict):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for gtin14, company_prefix_length in values.items():
+                self._values[gtin14] = (company_prefix_length, expires)
+                self._values.move_to_end(gtin14)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+prefix_cache = CompanyPrefixCache(
+    getattr(settings, 'QUARTET_EPCIS_PREFIX_CACHE_TTL', 300),
+    getattr(settings, 'QUARTET_EPCIS_PREFIX_CACHE_SIZE', 10000)
+)
+
+
+def get_company_prefix_lengths(gtins) -> dict:
+    """
+    Returns a dictionary of company prefix lengths keyed by GTIN 14.
+    Cached GTINs are answered without touching the master data; the rest
+    are looked up in a single trade item query with the DBProxy's company
+    search as the fallback for GTINs without a trade item.  GTINs with no
+    company prefix on record map to None.
+    :param gtins: An iterable of GTIN 14 strings.
+    """
+    ret = {}
+    uncached = set()
+    for gtin14 in set(gtins):
+        company_prefix_length = prefix_cache.get(gtin14)
+        if company_prefix_length is _missing:
+            uncached.add(gtin14)
+        else:
+            ret[gtin14] = company_prefix_length
+    if uncached:
+        found = {}
+        trade_items = TradeItem.objects.filter(GTIN14__in=uncached).values_list(
+            'GTIN14', 'company__gs1_company_prefix', 'NDC')
+        for gtin14, company_prefix, ndc in trade_items:
+            if company_prefix:
+                found[gtin14] = len(company_prefix)
+            elif ndc:
+                found[gtin14] = 2 + len(ndc.split('-')[0])
+            else:
+                found[gtin14] = None
+        for gtin14 in uncached - set(found):
+            try:
+                found[gtin14] = proxy.get_company_prefix_length(gtin14)
+            except DBProxy.InvalidBarcode:
+                # cached as unknown so the company scan is not repeated
+                logger.debug('No company prefix found for GTIN %s', gtin14)
+                found[gtin14] = None
+        prefix_cache.set_many(found)
+        ret.update(found)
+    return ret
+
+
+def convert_barcodes(terms) -> list:
+    """
+    Converts any GS1 barcodes in the list of terms to EPC URNs looking up
+    all of their company prefix lengths in one pass.  Terms that are not
+    barcodes, or that can not be converted, are returned as they are.
+    :param terms: A list of search terms.
+    :return: A list of the same length as terms.
+    """
+    matches = [SGTIN_SN_10_13_ALPHA.match(term) for term in terms]
+    lengths = get_company_prefix_lengths(
+        match.group('gtin14') for match in matches if match)
+    transformed_terms = []
+    for term, match in zip(terms, matches):
+        if match and lengths[match.group('gtin14')] is not None:
+            try:
+                cpl = lengths[match.group('gtin14')]
+                transformed_terms.append(
+                    BarcodeConverter(company_prefix_length=cpl,
+                                     barcode_val=term).epc_urn)
+            except:
+                logger.debug('Could not convert the barcode submitted %s',
+                             term)
+                transformed_terms.append(term)
+        else:
+            transformed_terms.append(term)
+    return transformed_terms
+
+
 class EntrySearchFilter(SearchFilter):
     """
     Will convert barcodes to URNS for search if one is detected.
@@ -30,19 +170,4 @@ class EntrySearchFilter(SearchFilter):
 
     def get_search_terms(self, request):
         terms = super().get_search_terms(request)
-        transformed_terms = []
-        for term in terms:
-            match = SGTIN_SN_10_13_ALPHA.match(term)
-            if match:
-                try:
-                    group_dict = match.groupdict()
-                    cpl = proxy.get_company_prefix_length(group_dict['gtin14'])
-                    transformed_terms.append(BarcodeConverter(company_prefix_length=cpl,
-                                                              barcode_val=term).epc_urn)
-                except:
-                    logger.debug('Could not convert the barcode submitted %s',
-                                 term)
-                    transformed_terms.append(term)
-            else:
-                transformed_terms.append(term)
-        return transformed_terms
+        return convert_barcodes(terms)
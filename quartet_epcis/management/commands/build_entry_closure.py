@@ -0,0 +1,31 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from quartet_epcis.db_api.queries import EPCISDBProxy
+
+
+class Command(BaseCommand):
+    help = _('Rebuilds the Entry closure table from the existing Entry '
+             'hierarchy.  Run once after setting QUARTET_EPCIS_ENTRY_CLOSURE '
+             'to True.')
+
+    def handle(self, *args, **options):
+        print('Rebuilding the entry closure table.')
+        with transaction.atomic():
+            count = EPCISDBProxy().rebuild_closure()
+        print('Done. %s closure records created.' % count)
@@ -0,0 +1,65 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from quartet_epcis.db_api import partitions
+
+
+class Command(BaseCommand):
+    help = _('Creates the upcoming monthly (see QUARTET_EPCIS_PARTITION_MONTHS) '
+             'partitions of the EntryEvent table.  Schedule it to run '
+             'regularly on systems with QUARTET_EPCIS_PARTITION_EVENTS '
+             'set to True.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead',
+                            dest='ahead',
+                            type=int,
+                            default=3,
+                            help='The number of partitions to create from '
+                                 'the current one on.')
+        parser.add_argument('--convert',
+                            dest='convert',
+                            action='store_true',
+                            help='Convert an existing, unpartitioned, '
+                                 'EntryEvent table first.  This rewrites the '
+                                 'table.')
+        parser.add_argument('--detach-before',
+                            dest='detach_before',
+                            type=date.fromisoformat,
+                            help='Detach the partitions holding only events '
+                                 'from before this date (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['convert'] and partitions.partition_table(
+                options['ahead']):
+                print('Converted the entry event table.')
+            if not partitions.is_partitioned():
+                raise CommandError(_('The entry event table is not '
+                                     'partitioned.  Partitioning requires '
+                                     'PostgreSQL and the --convert option or '
+                                     'the QUARTET_EPCIS_PARTITION_EVENTS '
+                                     'setting when migrating.'))
+            names = partitions.create_partitions(count=options['ahead'])
+            print('Partitions %s are in place.' % ', '.join(names))
+            if options['detach_before']:
+                names = partitions.detach_partitions(options['detach_before'])
+                print('Detached %s partitions: %s' % (len(names),
+                                                      ', '.join(names)))
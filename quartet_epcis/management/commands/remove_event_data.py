@@ -16,6 +16,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils.translation import gettext as _
 
+from quartet_epcis.db_api.cache import get_event_cache
 from quartet_epcis.models import entries, events, headers
 
 
@@ -39,6 +40,9 @@ class Command(BaseCommand):
             headers.SBDH.objects.all().delete()
             headers.Partner.objects.all().delete()
             headers.DocumentIdentification.objects.all().delete()
+            event_cache = get_event_cache()
+            if event_cache:
+                event_cache.clear()
             print('Done.')
         else:
             print('Not valid on non-debug systems.')
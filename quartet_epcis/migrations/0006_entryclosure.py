@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_epcis', '0005_auto_20200902_1023'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(help_text='The number of levels between the ancestor and the descendant.  A depth of 1 is a direct child.', verbose_name='Depth')),
+                ('ancestor', models.ForeignKey(help_text='The Entry higher in the hierarchy.', on_delete=django.db.models.deletion.CASCADE, related_name='closure_descendants', to='quartet_epcis.entry', verbose_name='Ancestor')),
+                ('descendant', models.ForeignKey(help_text='The Entry lower in the hierarchy.', on_delete=django.db.models.deletion.CASCADE, related_name='closure_ancestors', to='quartet_epcis.entry', verbose_name='Descendant')),
+            ],
+            options={
+                'verbose_name': 'Entry Closure',
+                'verbose_name_plural': 'Entry Closures',
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='entryclosure',
+            index=models.Index(fields=['descendant', 'depth'], name='entryclosure_descendant_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_epcis', '0006_entryclosure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['parent_id', 'decommissioned'], name='entry_parent_decom_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['top_id', 'decommissioned'], name='entry_top_decom_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(condition=models.Q(('decommissioned', False), ('is_parent', True)), fields=['parent_id'], name='entry_active_parents_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entryevent',
+            index=models.Index(fields=['identifier', 'event_time', 'event'], name='entryevent_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instancelotmasterdata',
+            index=models.Index(fields=['name', 'value'], name='ilmd_name_value_idx'),
+        ),
+        # drop the indexes the new ones replace once the new ones exist
+        migrations.AlterField(
+            model_name='entry',
+            name='parent_id',
+            field=models.ForeignKey(db_index=False, help_text='The parent of this identifier (if any).', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='parent_identifier', to='quartet_epcis.entry', verbose_name='Parent ID'),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='top_id',
+            field=models.ForeignKey(db_index=False, help_text='The top level id (if any).', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='top_identifier', to='quartet_epcis.entry', verbose_name='Top ID'),
+        ),
+        migrations.AlterField(
+            model_name='entryevent',
+            name='identifier',
+            field=models.CharField(help_text='A redundant entry ID entry for fast event composition.', max_length=150, verbose_name='EPC URN'),
+        ),
+    ]
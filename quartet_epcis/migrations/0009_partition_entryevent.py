@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def partition_entry_events(apps, schema_editor):
+    '''
+    Converts the EntryEvent table to a table partitioned by event_time on
+    PostgreSQL when the QUARTET_EPCIS_PARTITION_EVENTS setting is on.
+    Does nothing otherwise.
+    '''
+    from quartet_epcis.db_api import partitions
+    if partitions.partitioning_enabled():
+        partitions.partition_table(using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quartet_epcis', '0008_entry_created_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_entry_events,
+                             migrations.RunPython.noop),
+    ]
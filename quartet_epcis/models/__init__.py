@@ -15,7 +15,7 @@
 
 from .abstractmodels import UUIDModel, EPCISBusinessEvent, EPCISEvent, \
     SourceModel
-from .entries import Entry, EntryEvent
+from .entries import Entry, EntryEvent, EntryClosure
 from .events import TransformationID, ErrorDeclaration, Destination, \
     BusinessTransaction, QuantityElement, Source, InstanceLotMasterData, Event
 from .headers import DocumentIdentification, Partner, SBDH
@@ -39,7 +39,9 @@ class Entry(abstractmodels.UUIDModel):
         verbose_name=_("Parent ID"),
         related_name='parent_identifier',
         help_text=_("The parent of this identifier (if any)."),
-        null=True
+        null=True,
+        # indexed along with decommissioned in Meta.indexes
+        db_index=False
     )
     top_id = models.ForeignKey(
         'self',
@@ -47,7 +49,9 @@ class Entry(abstractmodels.UUIDModel):
         verbose_name=_("Top ID"),
         help_text=_("The top level id (if any)."),
         related_name='top_identifier',
-        null=True
+        null=True,
+        # indexed along with decommissioned in Meta.indexes
+        db_index=False
     )
     last_event = models.ForeignKey(
         'quartet_epcis.Event',
@@ -123,6 +127,20 @@ class Entry(abstractmodels.UUIDModel):
         verbose_name_plural = _('Entries')
         app_label = 'quartet_epcis'
         ordering = ['created']
+        indexes = [
+            models.Index(fields=['parent_id', 'decommissioned'],
+                         name='entry_parent_decom_idx'),
+            models.Index(fields=['top_id', 'decommissioned'],
+                         name='entry_top_decom_idx'),
+            # the (comparatively few) active parents for hierarchy walks
+            models.Index(fields=['parent_id'],
+                         condition=models.Q(is_parent=True,
+                                            decommissioned=False),
+                         name='entry_active_parents_idx'),
+            # the ordering used by the EntryViewSet's cursor pagination
+            models.Index(fields=['created', 'id'],
+                         name='entry_created_idx'),
+        ]
 
 
 class EntryEvent(models.Model):
@@ -164,7 +182,8 @@ class EntryEvent(models.Model):
         null=False,
         help_text=_('A redundant entry ID entry for fast event composition.'),
         verbose_name=_('EPC URN'),
-        db_index=True
+        # indexed along with the event_time in Meta.indexes
+        db_index=False
     )
     is_parent = models.BooleanField(
         default=False,
@@ -203,4 +222,50 @@ class EntryEvent(models.Model):
         verbose_name = _('Entry Event Record')
         verbose_name_plural = _('Entry Event Records')
         index_together = ["event", "entry"]
+        indexes = [
+            models.Index(fields=['identifier', 'event_time', 'event'],
+                         name='entryevent_history_idx'),
+        ]
+        app_label = 'quartet_epcis'
+
+
+class EntryClosure(models.Model):
+    '''
+    An optional closure table for the Entry hierarchy.  There is one
+    record for every Entry and each of the Entries above it in the
+    hierarchy so that everything inside (or above) an Entry can be found
+    with a single lookup.  Only maintained when the
+    QUARTET_EPCIS_ENTRY_CLOSURE setting is True.
+    '''
+    ancestor = models.ForeignKey(
+        'quartet_epcis.Entry',
+        null=False,
+        related_name='closure_descendants',
+        help_text=_('The Entry higher in the hierarchy.'),
+        verbose_name=_('Ancestor'),
+        on_delete=models.CASCADE
+    )
+    descendant = models.ForeignKey(
+        'quartet_epcis.Entry',
+        null=False,
+        related_name='closure_ancestors',
+        help_text=_('The Entry lower in the hierarchy.'),
+        verbose_name=_('Descendant'),
+        on_delete=models.CASCADE
+    )
+    depth = models.PositiveIntegerField(
+        null=False,
+        help_text=_('The number of levels between the ancestor and the '
+                    'descendant.  A depth of 1 is a direct child.'),
+        verbose_name=_('Depth')
+    )
+
+    class Meta:
+        verbose_name = _('Entry Closure')
+        verbose_name_plural = _('Entry Closures')
+        unique_together = ['ancestor', 'descendant']
+        indexes = [
+            models.Index(fields=['descendant', 'depth'],
+                         name='entryclosure_descendant_idx'),
+        ]
         app_label = 'quartet_epcis'
@@ -226,6 +226,9 @@ class InstanceLotMasterData(models.Model):
         app_label = 'quartet_epcis'
         verbose_name = _('ILMD Entry')
         verbose_name_plural = _('ILMD Entries')
+        indexes = [
+            models.Index(fields=['name', 'value'], name='ilmd_name_value_idx'),
+        ]
 
 
 class Source(abstractmodels.UUIDModel):
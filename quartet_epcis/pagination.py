@@ -0,0 +1,170 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import base64
+import json
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class NoCountCursorPagination(BasePagination):
+    '''
+    Pages forward through a viewset's queryset with a keyset cursor: the
+    cursor holds the values of the `ordering` fields for the last row on
+    the page and the next page starts after them, so each page is a range
+    scan on the ordering's index rather than an OFFSET.  The last field
+    in the ordering must be unique (the primary key) to break ties; rows
+    sharing the leading value are never repeated or skipped no matter how
+    many there are.  Unlike the page number and limit/offset paginators
+    it never runs a COUNT(*) so it stays fast on tables with hundreds of
+    millions of rows.
+    '''
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(
+                self.get_position_filter(queryset.model,
+                                         self.decode_cursor(encoded)))
+        rows = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_position = [self._get_value(rows[-1], field)
+                                  for field in self._fields()]
+        return rows
+
+    def get_position_filter(self, model, position: list) -> Q:
+        '''
+        Returns the filter for the rows after the position: the keyset
+        comparison (a, b) > (x, y) written out as a >= x AND (a > x OR
+        (a = x AND b > y)) so that the leading field's index bounds the
+        scan.  Descending fields compare with less than.
+        '''
+        fields = self._fields()
+        values = []
+        try:
+            for field, value in zip(fields, position):
+                values.append(model._meta.get_field(field).to_python(value))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        after = Q()
+        for i in reversed(range(len(fields))):
+            lookup = 'lt' if self.ordering[i].startswith('-') else 'gt'
+            condition = Q(**{'%s__%s' % (fields[i], lookup): values[i]})
+            if i < len(fields) - 1:
+                condition |= Q(**{fields[i]: values[i]}) & after
+            after = condition
+        lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        return Q(**{'%s__%s' % (fields[0], lookup): values[0]}) & after
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def encode_cursor(self, position: list) -> str:
+        value = json.dumps([
+            value.isoformat() if hasattr(value, 'isoformat') else str(value)
+            for value in position])
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, encoded: str) -> list:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _fields(self) -> list:
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _get_value(self, row, field):
+        # the ValuesListMixin pages through dictionaries
+        if isinstance(row, dict):
+            return row[field]
+        return getattr(row, field)
+
+
+class EntryCursorPagination(NoCountCursorPagination):
+    '''
+    Pages through Entries by creation time (see the entry_created_idx
+    index).
+    '''
+    ordering = ('created', 'id')
+
+
+class EntryEventCursorPagination(NoCountCursorPagination):
+    '''
+    Pages through EntryEvents by the time of their event.
+    '''
+    ordering = ('event_time', 'id')
+
+
+class EventCursorPagination(NoCountCursorPagination):
+    '''
+    Pages through Events from the most recent eventTime back.
+    '''
+    ordering = ('-event_time', '-id')
+
+
+use_no_count = getattr(settings, 'OPTIMIZE_HIGH_COUNT_MODEL_VIEWSETS', False)
+
+
+def get_pagination_class(pagination_class):
+    '''
+    Returns the pagination_class if the OPTIMIZE_HIGH_COUNT_MODEL_VIEWSETS
+    setting is on.  Otherwise returns the DRF default pagination class.
+    '''
+    if use_no_count:
+        return pagination_class
+    return api_settings.DEFAULT_PAGINATION_CLASS
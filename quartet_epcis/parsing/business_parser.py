@@ -14,12 +14,14 @@
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 import logging
 from datetime import datetime
-from dateutil.parser import parse as parse_date
 from django.utils.translation import gettext as _
 from typing import List
 from django.db.models import QuerySet
-from quartet_epcis.db_api.queries import EPCISDBProxy
+from quartet_epcis.db_api.queries import EPCISDBProxy, entry_closure_enabled
 from quartet_epcis.parsing import errors
+from quartet_epcis.parsing.cache import EntryCache
+from quartet_epcis.parsing.flush import FlushPolicy
+from quartet_epcis.parsing.loaders import BulkCreateLoader
 from quartet_epcis.parsing.parser import QuartetParser
 from quartet_epcis.models import entries, choices, events as db_events
 from EPCPyYes.core.v1_2 import events, events as yes_events
@@ -32,11 +34,26 @@ EntryList = List[entries.Entry]
 
 
 class BusinessEPCISParser(QuartetParser):
+    # the fields copied from a parent to its children on child updates
+    child_update_fields = ('last_event', 'last_event_time',
+                           'last_disposition')
+    # the business rules also move entries in and out of hierarchies and
+    # decommission them so those fields are written back as well
+    entry_update_fields = QuartetParser.entry_update_fields + (
+        'parent_id',
+        'top_id',
+        'is_parent',
+        'decommissioned',
+    )
 
     def __init__(self, stream, event_cache_size: int = 1024,
                  recursive_decommission: bool = True,
                  recursive_child_update: bool = False,
-                 child_update_from_top: bool = True
+                 child_update_from_top: bool = True,
+                 flush_policy: FlushPolicy = None,
+                 entry_cache_size: int = 100000,
+                 loader: BulkCreateLoader = None,
+                 pipelined: bool = False
                  ):
         '''
         Initializes a BusinessEPCISParser.  This parser will enforce business
@@ -46,13 +63,44 @@ class BusinessEPCISParser(QuartetParser):
         before being committed to the database.
         :param recursive_decommission: Whether or not Entries can be
         implicitly decommissioned when their parent or to Entry is.
+        :param flush_policy: The FlushPolicy that decides when the caches
+        are committed to the database.
+        :param entry_cache_size: The number of entries to keep in memory
+        between flushes.  Entries are kept for the duration of a single
+        message with the least recently used being evicted first.
+        :param loader: The loader used to write the cached rows to the
+        database.
+        :param pipelined: Whether or not to parse the XML on a background
+        thread while the events are being processed.
         '''
-        super().__init__(stream, event_cache_size)
+        super().__init__(stream, event_cache_size,
+                         flush_policy=flush_policy, loader=loader,
+                         pipelined=pipelined)
+        self.entry_cache = EntryCache(max_size=entry_cache_size)
         self.decommissioned_entry_cache = {}
         self.recursive_decommission = recursive_decommission
+        self.entry_closure = entry_closure_enabled()
         self.recursive_child_update = recursive_child_update
         self.child_update_from_top = child_update_from_top
 
+    def parse(self):
+        '''
+        Parses the message and then empties the entry cache so that no
+        entries are carried over to the next message.
+        '''
+        try:
+            return super().parse()
+        finally:
+            self._release_entry_cache()
+
+    def _release_entry_cache(self):
+        '''
+        Logs the entry cache statistics and empties the cache.  Called
+        once a message has been parsed, whether or not it succeeded.
+        '''
+        logger.debug('Entry cache statistics: %s', self.entry_cache.stats)
+        self.entry_cache.clear()
+
     def handle_aggregation_event(
         self,
         epcis_event: events.AggregationEvent
@@ -118,7 +166,11 @@ class BusinessEPCISParser(QuartetParser):
             db_entries = self._get_entries(epcis_event.epc_list)
             self._update_event_entries(db_entries, db_event, epcis_event)
             if epcis_event.action == events.Action.delete.value:
-                self._decommission_entries(db_entries, db_event, epcis_event)
+                if self.entry_closure:
+                    db_proxy.remove_entries_from_closure(
+                        db_entries, self.recursive_decommission)
+                self._decommission_entries(db_entries, db_event, epcis_event,
+                                           self.recursive_decommission)
             for db_entry in db_entries:
                 entryevent = entries.EntryEvent(
                     entry=db_entry,
@@ -171,6 +223,8 @@ class BusinessEPCISParser(QuartetParser):
                 # just check the parent to make sure that the parent is
                 # a valid epc
                 parent = self._get_entry(epc=epcis_event.parent_id)
+                if self.entry_closure:
+                    db_proxy.add_to_closure(parent, db_entries)
                 self.create_entry_events(db_entries, db_event, epcis_event)
                 self._update_aggregation_entries(db_entries, parent, db_event,
                                                  epcis_event)
@@ -227,24 +281,24 @@ class BusinessEPCISParser(QuartetParser):
         and an integer expressing the number of entries found.
         '''
         db_entries = []
-        count = 0
+        missing = []
         parent = self._get_entry(epcis_event.parent_id)
         # try the local cache
         for epc in epcis_event.child_epcs:
             entry = self.entry_cache.get(epc)
-            if entry and not entry.decommissioned and not entry.parent_id:
+            if not entry:
+                missing.append(epc)
+            elif not entry.decommissioned and not entry.parent_id_id:
                 db_entries.append(entry)
-        count = len(db_entries)
-        # if nothing was found, try the database
-        if count < len(epcis_event.child_epcs):
-            kwargs = {'identifier__in': epcis_event.child_epcs,
+        # anything that was not cached comes from the database
+        if missing:
+            kwargs = {'identifier__in': missing,
                       'decommissioned': False,
                       'parent_id': None}
-            db_entries = entries.Entry.objects.select_for_update().filter(
-                **kwargs
+            db_entries += list(
+                entries.Entry.objects.select_for_update().filter(**kwargs)
             )
-            count = db_entries.count()
-        return db_entries, count
+        return db_entries, len(db_entries)
 
     def _update_aggregation_entries(
         self,
@@ -262,9 +316,10 @@ class BusinessEPCISParser(QuartetParser):
         :param entries: A queryset or list of entries.
         :return: None
         '''
+        event_time = self._parse_date(epcis_event)
         # the top is the parent's top or the parent itself...
         for db_entry in db_entries:
-            db_entry.last_aggregation_event_time = epcis_event.event_time
+            db_entry.last_aggregation_event_time = event_time
             db_entry.last_aggregation_event = db_event
             db_entry.last_aggregation_event_action = epcis_event.action
             if parent:
@@ -272,7 +327,7 @@ class BusinessEPCISParser(QuartetParser):
             else:
                 db_entry.top_id = parent
             db_entry.last_event = db_event
-            db_entry.last_event_time = self._parse_date(epcis_event)
+            db_entry.last_event_time = event_time
             db_entry.last_disposition = epcis_event.disposition
             db_entry.parent_id = parent
             # db_entry.save()
@@ -287,24 +342,33 @@ class BusinessEPCISParser(QuartetParser):
             self.entry_cache[db_entry.identifier] = db_entry
 
     def _parse_date(self, epcis_event):
-        event_time = parse_date(epcis_event.event_time)
-        return event_time
+        '''
+        Returns the event time of the event as a datetime.  The event time
+        is only parsed once per event.
+        '''
+        return self._get_event_time(epcis_event)
 
     def _get_child_entries(self, db_entry: entries.Entry):
         '''
         Gets child entries for an entry from the cache first then
-        from the database in not found.
+        from the database if the cache does not already hold all of them.
         :param db_entry: An entry marked with is_parent = True
-        :return: A list or QuerySet of child entries.
+        :return: A list of child entries.
         '''
         # look in the cache first
-        ret = []
-        for k, v in self.entry_cache.items():
-            if v.parent_id == db_entry:
-                ret.append(v)
-        # now get any from the db
-        db_children = db_proxy.get_entries_by_parent(db_entry)
+        ret = self.entry_cache.get_children(db_entry.pk)
+        if db_entry.pk in self.entry_cache.complete:
+            return ret
+        # marked before loading so an eviction during the load undoes it
+        self.entry_cache.mark_complete(db_entry.pk)
+        # now get any from the db that are not cached, the cached copies
+        # are more up to date than the database
+        db_children = db_proxy.get_entries_by_parent(db_entry.identifier)
         for db_child in db_children:
+            if (db_child.identifier in self.entry_cache or
+                db_child.identifier in self.decommissioned_entry_cache):
+                continue
+            self.entry_cache.load(db_child.identifier, db_child)
             ret.append(db_child)
         return ret
 
@@ -329,6 +393,7 @@ class BusinessEPCISParser(QuartetParser):
                 db_entry.last_event = db_event
                 db_entry.last_event_time = self._parse_date(epcis_event)
                 db_entry.last_disposition = epcis_event.disposition
+                self.entry_cache[db_entry.identifier] = db_entry
         elif isinstance(db_entries, QuerySet):
             # update the database
             count = db_entries.update(
@@ -377,7 +442,7 @@ class BusinessEPCISParser(QuartetParser):
         entry.last_disposition = epcis_event.disposition
         # entry.save()
         # if its not in the cache it needs to be added
-        self.entry_cache[entry.identifier] == entry
+        self.entry_cache[entry.identifier] = entry
         # create an entry event and add to the cache
         self._create_parent_entry_event(db_event, epcis_event)
         logger.debug('Cached Entry for top id %s', epcis_event.parent_id)
@@ -393,17 +458,25 @@ class BusinessEPCISParser(QuartetParser):
             db_entries = self._get_entries(
                 epcis_event.child_epcs
             )
+            if self.entry_closure:
+                db_proxy.remove_from_closure(
+                    self._get_entry(epcis_event.parent_id), db_entries)
             # create the entry events for the children
             self.create_entry_events(db_entries, db_event, epcis_event)
         else:
             db_entries = db_proxy.get_entries_by_parent(epcis_event.parent_id)
             # clear out any entries that have these as top_id
-            lower_entries = db_proxy.get_entries_by_top(
-                self._get_entry(epcis_event.parent_id)
-            )
+            top = self._get_entry(epcis_event.parent_id)
+            if self.entry_closure:
+                db_proxy.remove_from_closure(top)
+            lower_entries = db_proxy.get_entries_by_top(top)
             lower_entries.update(
                 top_id=None
             )
+            # keep any cached entries in step with the database
+            for cached_entry in self.entry_cache.values():
+                if cached_entry.top_id_id == top.pk:
+                    cached_entry.top_id = None
         self._create_parent_entry_event(db_event, epcis_event)
 
         self._update_aggregation_entries(
@@ -452,7 +525,7 @@ class BusinessEPCISParser(QuartetParser):
                     decommissioned=False
                 )
                 # add it to the cache
-                self.entry_cache[epc] = entry
+                self.entry_cache.load(epc, entry)
             except entries.Entry.DoesNotExist:
                 raise errors.EntryException(
                     _('The entry with identifier %s could '
@@ -468,23 +541,29 @@ class BusinessEPCISParser(QuartetParser):
         :param epcs: The epcs to use for lookup of entries.
         :return: A list or queryset of entries.
         '''
-        db_entries = []
+        found = {}
+        missing = []
         for epc in epcs:
-            epc = self.entry_cache.get(epc)
-            if epc: db_entries.append(epc)
-        if len(db_entries) != len(epcs):
-            db_entries = db_proxy.get_entries_by_epcs(
-                epcs,
+            entry = self.entry_cache.get(epc)
+            if entry:
+                found[epc] = entry
+            else:
+                missing.append(epc)
+        if missing:
+            for entry in db_proxy.get_entries_by_epcs(
+                missing,
                 select_for_update=False
-            )
-            if db_entries.count() != len(epcs):
+            ):
+                self.entry_cache.load(entry.identifier, entry)
+                found[entry.identifier] = entry
+            if len(found) != len(set(epcs)):
                 raise errors.EntryException(
                     _('Invalid Entry in %s.  One of the values in the '
                       'event has either '
                       'been decommissioned or was '
                       'never commissioned.' % epcs)
                 )
-        return db_entries
+        return [found[epc] for epc in epcs]
 
     def _decommission_entries(
         self,
@@ -500,9 +579,7 @@ class BusinessEPCISParser(QuartetParser):
         Default = True
         '''
         if recursive:
-            children = db_proxy.get_entries_by_parents(db_entries)
-            if children.count() > 0:
-                self._decommission_entries(children, db_event, epcis_event)
+            self._decommission_descendants(db_entries, db_event, epcis_event)
         for entry in db_entries:
             entry.decommissioned = True
             entry.last_event = db_event
@@ -520,71 +597,133 @@ class BusinessEPCISParser(QuartetParser):
                                              output=False)
             self.entry_event_cache.append(entry_event)
 
+    def _decommission_descendants(
+        self,
+        db_entries: EntryList,
+        db_event: db_events.Event,
+        epcis_event: events.EPCISEvent
+    ):
+        '''
+        Decommissions everything beneath the entries.  The database rows are
+        found and updated with a recursive query and their EntryEvents are
+        created without loading the entries.  Anything in the entry cache
+        (including children packed earlier in this message) is
+        decommissioned in memory so the cache does not go stale.
+        :param db_entries: The entries being decommissioned.
+        '''
+        roots = [entry.pk for entry in db_entries]
+        rows = db_proxy.get_descendant_entries(roots)
+        cached = {}
+        db_rows = []
+        for entry_id, identifier in rows:
+            entry = self.entry_cache.get(identifier)
+            if entry:
+                cached[identifier] = entry
+            elif identifier not in self.decommissioned_entry_cache:
+                db_rows.append((entry_id, identifier))
+        # walk down the cached hierarchy for children that are not in
+        # the database yet
+        stack = list(db_entries) + list(cached.values())
+        while stack:
+            for child in self.entry_cache.get_children(stack.pop().pk):
+                if child.identifier not in cached:
+                    cached[child.identifier] = child
+                    stack.append(child)
+        if db_rows:
+            db_proxy.update_descendant_entries(
+                roots,
+                decommissioned=True,
+                last_event=db_event,
+                last_event_time=self._parse_date(epcis_event),
+                last_disposition=epcis_event.disposition
+            )
+            for entry_id, identifier in db_rows:
+                self.entry_event_cache.append(
+                    entries.EntryEvent(entry_id=entry_id,
+                                       event_time=epcis_event.event_time,
+                                       event_type=db_event.type,
+                                       event=db_event,
+                                       identifier=identifier,
+                                       output=False)
+                )
+        if cached:
+            self._decommission_entries(list(cached.values()), db_event,
+                                       epcis_event, recursive=False)
+
     def _recursive_child_update(self, parents: list):
         """
         Will update all children of all entries that were just saved with
         the parent disposition (this excludes the decommissioned entries
-        cache).  This will recursively execute and is useful to use if there
-        are incomplete hierarchy records within the system.
+        cache).  Children of top level entries are updated through top_id
+        and the children of any other parents are updated through a
+        recursive query so that incomplete hierarchy records in the system
+        still get updated.
         :return: None
         """
         tops = [entry for entry in parents if entry.is_top]
-        parents = [entry for entry in parents if entry.is_parent and entry.is_top is False]
-        for entry in tops:
-            children = db_proxy.get_entries_by_top(entry, select_for_update=False)
-            children.all().update(
-                last_event=entry.last_event,
-                last_event_time=entry.last_event_time,
-                last_disposition=entry.last_disposition,
+        top_ids = {entry.pk for entry in tops}
+        parents = [entry for entry in parents if entry.is_parent and
+                   entry.is_top is False and entry.top_id_id not in top_ids]
+        self._child_update(tops)
+        if parents:
+            db_proxy.propagate_to_descendants(
+                [entry.pk for entry in parents], self.child_update_fields
             )
-        for entry in parents:
-            if entry.top_id not in tops:
-                children = db_proxy.get_entries_by_parent(entry, select_for_update=False)
-                children.all().update(
-                    last_event=entry.last_event,
-                    last_event_time=entry.last_event_time,
-                    last_disposition=entry.last_disposition,
-                )
-                child_parents = [child for child in children if child.is_parent]
-                self._recursive_child_update(child_parents)
 
     def _child_update(self, tops: EntryList):
         """
         Will update all children of all entries that were just saved with
         the parent disposition (this excludes the decommissioned entries
-        cache).
+        cache).  Each child takes the values of its own top.
         :return: None
         """
-        for entry in tops:
-            entries.Entry.objects.filter(
-                top_id__in=tops
-            ).update(
-                last_event=entry.last_event,
-                last_event_time=entry.last_event_time,
-                last_disposition=entry.last_disposition,
-            )
+        if tops:
+            db_proxy.update_entries_from_tops(tops, self.child_update_fields)
+
+    @property
+    def cached_entry_count(self) -> int:
+        '''
+        The number of changed entries waiting to be written, including
+        the decommissioned entries.  Clean entries kept in the cache
+        between flushes are not counted.
+        '''
+        return len(self.entry_cache.dirty) + len(
+            self.decommissioned_entry_cache)
 
     def clear_cache(self):
         # create events
         event_cache = self._get_sorted_event_cache()
-        db_events.Event.objects.bulk_create(event_cache)
+        self.loader.load(db_events.Event, event_cache)
         # update entries
-        for db_entry in list(self.entry_cache.values()):
-            db_entry.save()
+        dirty_entries = self.entry_cache.dirty_values()
+        self._update_entries(dirty_entries)
         if self.recursive_child_update:
             if self.child_update_from_top:
-                tops = [entry for entry in self.entry_cache.values() if
+                tops = [entry for entry in dirty_entries if
                            entry.is_top]
                 self._child_update(tops)
+                updated = {entry.pk for entry in tops}
             else:
-                parents = [entry for entry in self.entry_cache.values() if
+                parents = [entry for entry in dirty_entries if
                        entry.is_parent]
                 self._recursive_child_update(parents)
+                updated = {entry.top_id_id or entry.pk for entry in parents}
+            # the children were updated in the database so drop any
+            # cached copies, including the ones written above
+            self.entry_cache.evict_where(
+                lambda entry: entry.top_id_id in updated,
+                include_dirty=True
+            )
         # clear the event cache
         self.event_cache.clear()
-        decommissioned_entries = list(
-            self.decommissioned_entry_cache.values())
-        for decommissioned_entry in decommissioned_entries:
-            decommissioned_entry.save()
-        decommissioned_entries.clear()
+        self._update_entries(
+            list(self.decommissioned_entry_cache.values()))
+        self.decommissioned_entry_cache.clear()
         super().clear_cache()
+
+    def _clear_entry_cache(self):
+        '''
+        Entries survive a flush.  Now that they have been written they are
+        simply marked as clean.
+        '''
+        self.entry_cache.mark_clean()
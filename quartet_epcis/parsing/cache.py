@@ -0,0 +1,190 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EntryCache(OrderedDict):
+    """
+    A bounded, least-recently-used cache of Entry model instances keyed
+    by identifier.
+
+    Entries that are set in the cache are considered dirty until
+    `mark_clean` is called after they have been written to the database.
+    Entries that are only loaded for lookups are clean.  Once the cache
+    grows past max_size the least recently used clean entries are evicted;
+    dirty entries are never evicted so no pending changes can be lost.
+
+    The cache also keeps an index of the cached children of each parent
+    entry which is updated every time an entry is set or loaded.  A parent
+    is marked as complete once all of its children have been loaded; it
+    stays complete until one of its children is evicted.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        """
+        :param max_size: The number of entries to hold before clean entries
+        are evicted.  None for no limit.
+        """
+        super().__init__()
+        self.max_size = max_size
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.complete = set()
+        self._children = {}
+        self._parents = {}
+
+    def get(self, identifier, default=None):
+        """
+        Returns the cached entry and marks it as most recently used.
+        """
+        if identifier in self:
+            self.hits += 1
+            self.move_to_end(identifier)
+            return super().__getitem__(identifier)
+        self.misses += 1
+        return default
+
+    def __setitem__(self, identifier, entry):
+        super().__setitem__(identifier, entry)
+        self.move_to_end(identifier)
+        self.dirty.add(identifier)
+        self._index(identifier, entry)
+        self._evict()
+
+    def load(self, identifier, entry):
+        """
+        Adds an entry that was just read from the database without marking
+        it as dirty.
+        """
+        super().__setitem__(identifier, entry)
+        self.move_to_end(identifier)
+        self._index(identifier, entry)
+        self._evict()
+
+    def pop(self, identifier, default=None):
+        self.dirty.discard(identifier)
+        self._unindex(identifier)
+        return super().pop(identifier, default)
+
+    def clear(self):
+        super().clear()
+        self.dirty.clear()
+        self.complete.clear()
+        self._children.clear()
+        self._parents.clear()
+
+    def get_children(self, parent_pk) -> list:
+        """
+        :param parent_pk: The primary key of the parent Entry.
+        :return: The cached entries whose parent is the given entry.
+        """
+        return [super(EntryCache, self).__getitem__(identifier)
+                for identifier in self._children.get(parent_pk, ())]
+
+    def mark_complete(self, parent_pk):
+        """
+        Records that every child of the parent is in the cache so the
+        database does not need to be checked for more.
+        """
+        self.complete.add(parent_pk)
+
+    def dirty_values(self) -> list:
+        """
+        :return: The entries that have changed since the last flush.
+        """
+        return [super(EntryCache, self).__getitem__(identifier)
+                for identifier in self.dirty]
+
+    def mark_clean(self):
+        """
+        Called once the dirty entries have been written to the database.
+        """
+        self.dirty.clear()
+        self._evict()
+
+    def evict_where(self, predicate, include_dirty=False):
+        """
+        Removes any clean entries that match the predicate.  Used when the
+        database has been updated behind the cache.
+        :param predicate: A callable that takes an Entry and returns True
+        if it should be removed.
+        :param include_dirty: Remove matching dirty entries as well.  Only
+        for use once the dirty entries have been written to the database.
+        """
+        stale = [identifier for identifier, entry in self.items()
+                 if (include_dirty or identifier not in self.dirty)
+                 and predicate(entry)]
+        for identifier in stale:
+            self.dirty.discard(identifier)
+            self._remove(identifier)
+        self.evictions += len(stale)
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: The hit, miss and eviction counts along with the current
+        size of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self),
+            'dirty': len(self.dirty),
+        }
+
+    def _evict(self):
+        if self.max_size is None or len(self) <= self.max_size:
+            return
+        excess = len(self) - self.max_size
+        victims = []
+        for identifier in self:
+            if identifier not in self.dirty:
+                victims.append(identifier)
+                if len(victims) == excess:
+                    break
+        for identifier in victims:
+            self._remove(identifier)
+        self.evictions += len(victims)
+
+    def _remove(self, identifier):
+        # a parent whose child is evicted may have children that are no
+        # longer cached
+        self.complete.discard(self._parents.get(identifier))
+        self._unindex(identifier)
+        super().__delitem__(identifier)
+
+    def _index(self, identifier, entry):
+        parent_pk = entry.parent_id_id
+        old_parent_pk = self._parents.get(identifier)
+        if old_parent_pk == parent_pk:
+            return
+        self._unindex(identifier)
+        if parent_pk is not None:
+            self._children.setdefault(parent_pk, set()).add(identifier)
+            self._parents[identifier] = parent_pk
+
+    def _unindex(self, identifier):
+        parent_pk = self._parents.pop(identifier, None)
+        if parent_pk is not None:
+            children = self._children[parent_pk]
+            children.discard(identifier)
+            if not children:
+                del self._children[parent_pk]
@@ -14,6 +14,8 @@
 # Copyright 2020 SerialLab Corp.  All rights reserved.
 from EPCPyYes.core.v1_2 import events, events as yes_events
 from quartet_epcis.parsing.business_parser import BusinessEPCISParser as bep
+from quartet_epcis.parsing.flush import FlushPolicy
+from quartet_epcis.parsing.loaders import BulkCreateLoader
 from quartet_capture.rules import RuleContext
 
 class BusinessEPCISParser(bep):
@@ -27,9 +29,14 @@ class BusinessEPCISParser(bep):
                  recursive_decommission: bool = True,
                  recursive_child_update: bool = False,
                  child_update_from_top: bool = True,
-                 rule_context: RuleContext = None):
+                 rule_context: RuleContext = None,
+                 flush_policy: FlushPolicy = None,
+                 entry_cache_size: int = 100000,
+                 loader: BulkCreateLoader = None,
+                 pipelined: bool = False):
         super().__init__(stream, event_cache_size, recursive_decommission,
-                         recursive_child_update, child_update_from_top)
+                         recursive_child_update, child_update_from_top,
+                         flush_policy, entry_cache_size, loader, pipelined)
         self.rule_context = rule_context
         self.counter = 0
 
@@ -0,0 +1,59 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from dateutil.parser import parse as parse_date
+
+# the date/time format used by the overwhelming majority of EPCIS
+# documents: 2018-01-22T22:51:49.294565+00:00, 2018-01-22T22:51:49Z, etc.
+ISO_8601 = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})"
+    r"(?:\.(\d{1,9}))?"
+    r"(?:(Z|z)|([+-])(\d{2}):?(\d{2}))?$"
+)
+
+
+@lru_cache(maxsize=4096)
+def parse_event_time(value: str) -> datetime:
+    """
+    Converts an EPCIS date/time string to a datetime.  Strings in the
+    common ISO 8601 format are converted directly; anything else is handed
+    to dateutil.  Results are memoized since most messages repeat the same
+    handful of event times over and over.
+    :param value: The date/time string.
+    :return: A datetime.  Naive if the string had no offset.
+    """
+    match = ISO_8601.match(value.strip())
+    if not match:
+        return parse_date(value)
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    tzinfo = None
+    if zulu:
+        tzinfo = timezone.utc
+    elif sign:
+        offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        tzinfo = timezone(-offset if sign == "-" else offset)
+    try:
+        return datetime(
+            int(year), int(month), int(day), int(hour), int(minute),
+            int(second), microsecond, tzinfo=tzinfo,
+        )
+    except ValueError:
+        # out of range values (leap seconds, 24:00:00, etc.)
+        return parse_date(value)
@@ -0,0 +1,63 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlushPolicy:
+    """
+    Decides when a parser should push its caches to the database.  A flush
+    is triggered as soon as any one of the limits is reached.  Any limit
+    set to None is ignored.
+    """
+
+    def __init__(
+        self,
+        max_events: int = 1024,
+        max_entries: int = 50000,
+        max_rows: int = 100000,
+    ):
+        """
+        :param max_events: The number of buffered Event records.
+        :param max_entries: The number of cached Entry records.
+        :param max_rows: The total number of buffered rows across all of
+        the parser caches (events, entry events, quantity elements, ILMD,
+        sources, destinations, etc.)
+        """
+        self.max_events = max_events
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+
+    def should_flush(self, parser) -> bool:
+        """
+        Inspects the caches of a QuartetParser and returns True if any of
+        the limits have been reached.
+        :param parser: The QuartetParser (or subclass) being checked.
+        :return: True if the caches should be flushed.
+        """
+        if self._reached(self.max_events, parser.cached_event_count):
+            logger.debug("Event limit of %s reached.", self.max_events)
+            return True
+        if self._reached(self.max_entries, parser.cached_entry_count):
+            logger.debug("Entry limit of %s reached.", self.max_entries)
+            return True
+        if self._reached(self.max_rows, parser.cached_row_count):
+            logger.debug("Row limit of %s reached.", self.max_rows)
+            return True
+        return False
+
+    def _reached(self, limit: int, count: int):
+        return limit is not None and count >= limit
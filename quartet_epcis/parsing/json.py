@@ -12,6 +12,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
+import codecs
+import io
 import json
 
 from EPCPyYes.core.v1_2 import json_decoders, events as yes_events
@@ -20,37 +22,166 @@ from quartet_epcis.parsing.context_parser import BusinessEPCISParser
 
 
 class JSONParser(BusinessEPCISParser):
+    '''
+    Parses EPCPyYes JSON.  The events array is read from the stream one
+    event at a time so memory use is bounded by the flush policy rather
+    than the size of the inbound document.
+    '''
+    chunk_size = 65536
 
     def parse(self):
         self._message = headers.Message()
         self._message.save()
-        if self.stream.startswith('/'):
-            with open(self.stream, 'r') as f:
-                self.stream = f.read()
-        jsonobj = json.loads(self.stream)
-        events = jsonobj.get('events', [])
-        if len(events) == 0:
-            raise self.NoEventsError('There were no events in the inbound'
-                                     ' JSON file.')
-        for event in events:
-            if 'objectEvent' in event:
-                decoder = json_decoders.ObjectEventDecoder(event)
-                self.handle_object_event(decoder.get_event())
-            elif 'aggregationEvent' in event:
-                decoder = json_decoders.AggregationEventDecoder(event)
-                self.handle_aggregation_event(decoder.get_event())
-            elif 'transactionEvent' in event:
-                decoder = json_decoders.TransactionEventDecoder(event)
-                self.handle_transaction_event(decoder.get_event())
+        try:
+            if isinstance(self.stream, str) and self.stream.startswith('/'):
+                with open(self.stream, 'r') as f:
+                    self._parse_events(f)
+            elif isinstance(self.stream, str):
+                self._parse_events(io.StringIO(self.stream))
+            elif isinstance(self.stream, bytes):
+                self._parse_events(io.BytesIO(self.stream))
             else:
-                raise self.InvalidEventError('The JSON parser encountered an'
-                                             ' event that could not be parsed'
-                                             ' %s' % str(event))
-        self.clear_cache()
+                self._parse_events(self.stream)
+            self.clear_cache()
+        finally:
+            self._release_entry_cache()
         return self._message.id
 
+    def _parse_events(self, fp):
+        count = 0
+        for event in JSONArrayReader(fp, self.chunk_size).iter_items(
+            'events'):
+            self.handle_event(event)
+            self.check_flush_policy()
+            count += 1
+        if count == 0:
+            raise self.NoEventsError('There were no events in the inbound'
+                                     ' JSON file.')
+
+    def handle_event(self, event: dict):
+        '''
+        Decodes a single item from the events array and hands it to the
+        matching event handler.
+        :param event: The JSON event as a dictionary.
+        '''
+        if 'objectEvent' in event:
+            decoder = json_decoders.ObjectEventDecoder(event)
+            self.handle_object_event(decoder.get_event())
+        elif 'aggregationEvent' in event:
+            decoder = json_decoders.AggregationEventDecoder(event)
+            self.handle_aggregation_event(decoder.get_event())
+        elif 'transactionEvent' in event:
+            decoder = json_decoders.TransactionEventDecoder(event)
+            self.handle_transaction_event(decoder.get_event())
+        else:
+            raise self.InvalidEventError('The JSON parser encountered an'
+                                         ' event that could not be parsed'
+                                         ' %s' % str(event))
+
     class NoEventsError(Exception):
         pass
 
     class InvalidEventError(Exception):
         pass
+
+
+class JSONArrayReader:
+    '''
+    Reads the items of an array in the top level object of a JSON document
+    from a text or binary file-like object without loading the whole
+    document into memory.  Only one array item (plus a read chunk) is held
+    at a time.
+    '''
+    whitespace = ' \t\r\n'
+
+    def __init__(self, fp, chunk_size: int = 65536):
+        '''
+        :param fp: A file-like object opened in text or binary mode.  Binary
+        data is decoded as UTF-8.
+        :param chunk_size: The number of characters/bytes to read at a time.
+        '''
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+
+    def iter_items(self, key: str):
+        '''
+        Yields each item of the array stored under key in the top level
+        object.  Any other top level values are decoded and discarded.
+        :param key: The name of the array, for example "events".
+        '''
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == key and self._peek() == '[':
+                self._expect('[')
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self._value()
+            if self._expect(',}') == '}':
+                return
+
+    def _read(self, size: int) -> bool:
+        chunk = self.fp.read(size)
+        while isinstance(chunk, bytes):
+            text = self._text_decoder.decode(chunk, final=not chunk)
+            if text or not chunk:
+                chunk = text
+            else:
+                # only part of a multi-byte character was read
+                chunk = self.fp.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while (self.pos < len(self.buffer) and
+                   self.buffer[self.pos] in self.whitespace):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read(self.chunk_size):
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError('Expecting one of %s' % chars,
+                                       self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value runs past the end of the buffer, read more and
+                # grow the read size so large values are not rescanned
+                # too often
+                if not self._read(size):
+                    raise
+                size *= 2
+                continue
+            # a number at the end of the buffer may have been cut short
+            if end == len(self.buffer) and self._read(size):
+                continue
+            self.pos = end
+            return obj
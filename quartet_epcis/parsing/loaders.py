@@ -0,0 +1,118 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import io
+import logging
+
+from django.conf import settings
+from django.db import connection as default_connection
+
+logger = logging.getLogger(__name__)
+
+
+class BulkCreateLoader:
+    """
+    Writes the parser caches to the database using the Django ORM's
+    bulk_create.  Works on every database Django supports.
+    """
+
+    def __init__(self, connection=None, batch_size: int = None):
+        """
+        :param connection: The database connection to write to.  Defaults
+        to the default connection.
+        :param batch_size: Passed on to bulk_create.
+        """
+        self.connection = connection or default_connection
+        self.batch_size = batch_size
+
+    def load(self, model, objs: list):
+        """
+        Inserts the model instances into the model's table.
+        :param model: The Django model class.
+        :param objs: A list of unsaved instances of the model.
+        """
+        if objs:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+
+class CopyLoader(BulkCreateLoader):
+    """
+    Streams the parser caches into their tables using PostgreSQL's
+    COPY FROM STDIN in CSV format.  This skips the large parameterized
+    INSERT statements bulk_create generates and is considerably faster
+    for the big tables such as EntryEvent.
+    """
+
+    null = "\\N"
+
+    def load(self, model, objs: list):
+        if not objs:
+            return
+        fields = [
+            field
+            for field in model._meta.concrete_fields
+            # leave out auto-incrementing primary keys
+            if not (field.primary_key and getattr(objs[0], field.attname) is None)
+        ]
+        buffer = io.StringIO()
+        for obj in objs:
+            buffer.write(self._format_row(obj, fields))
+        buffer.seek(0)
+        sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s')" % (
+            self.connection.ops.quote_name(model._meta.db_table),
+            ", ".join(
+                self.connection.ops.quote_name(field.column) for field in fields
+            ),
+            self.null,
+        )
+        logger.debug("Copying %s rows into %s.", len(objs), model._meta.db_table)
+        with self.connection.cursor() as cursor:
+            self._copy(cursor.cursor, sql, buffer)
+
+    def _format_row(self, obj, fields) -> str:
+        values = []
+        for field in fields:
+            value = field.get_db_prep_save(
+                field.pre_save(obj, add=True), connection=self.connection
+            )
+            if value is None:
+                values.append(self.null)
+            else:
+                # quoted values are never treated as NULL by COPY
+                values.append('"%s"' % str(value).replace('"', '""'))
+        return ",".join(values) + "\n"
+
+    def _copy(self, raw_cursor, sql: str, buffer: io.StringIO):
+        if hasattr(raw_cursor, "copy_expert"):
+            # psycopg2
+            raw_cursor.copy_expert(sql, buffer)
+        else:
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def get_loader(connection=None) -> BulkCreateLoader:
+    """
+    Returns the CopyLoader when the connection is PostgreSQL and the
+    QUARTET_EPCIS_COPY_LOADER setting has not been set to False; otherwise
+    returns a BulkCreateLoader.
+    :param connection: The database connection.  Defaults to the default
+    connection.
+    """
+    connection = connection or default_connection
+    use_copy = getattr(settings, "QUARTET_EPCIS_COPY_LOADER", True)
+    if use_copy and connection.vendor == "postgresql":
+        return CopyLoader(connection)
+    return BulkCreateLoader(connection)
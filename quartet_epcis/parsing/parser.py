@@ -13,13 +13,18 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 import logging
+import queue
+import threading
 from typing import List
 import pytz
 from datetime import datetime
-from dateutil.parser import parse as parse_date
 from eparsecis.eparsecis import FlexibleNSParser
 from quartet_epcis.models import events, entries, choices, headers
 from quartet_epcis.parsing import errors
+from quartet_epcis.parsing.dates import parse_event_time
+from quartet_epcis.parsing.flush import FlushPolicy
+from quartet_epcis.parsing.loaders import BulkCreateLoader, get_loader
+from quartet_epcis.parsing.pipeline import QueueingParser
 from EPCPyYes.core.v1_2 import events as yes_events
 from EPCPyYes.core.v1_2 import template_events
 from EPCPyYes.core.SBDH import template_sbdh
@@ -34,7 +39,29 @@ destination_list = List[yes_events.Destination]
 
 
 class QuartetParser(FlexibleNSParser):
-    def __init__(self, stream, event_cache_size: int = 1024):
+    # the Entry fields that are written when an entry takes part in an event
+    entry_update_fields = (
+        "last_event",
+        "last_event_time",
+        "last_disposition",
+        "last_aggregation_event",
+        "last_aggregation_event_time",
+        "last_aggregation_event_action",
+    )
+    # the maximum number of entries written by a single UPDATE statement
+    entry_update_batch_size = 1000
+    pipeline_depth = 8
+    pipeline_batch_size = 64
+
+    def __init__(
+        self,
+        stream,
+        event_cache_size: int = 1024,
+        batch_entries: bool = True,
+        flush_policy: FlushPolicy = None,
+        loader: BulkCreateLoader = None,
+        pipelined: bool = False,
+    ):
         """
         Initializes a new QuartetParser.  Item entries and events will
         be cached in memory until either the event_cache_size or
@@ -46,8 +73,30 @@ class QuartetParser(FlexibleNSParser):
         :param stream: The EPCIS stream to parse.
         :param event_cache_size: defaults to 1024.  The number of events
         to cache in memory before pushing to the back-end datastore.
+        :param batch_entries: defaults to True.  If True, the EPCs in an
+        event are resolved with a single query and any new Entry records
+        are created with a single bulk insert.  If False, each EPC is
+        looked up and saved individually.
+        :param flush_policy: The FlushPolicy that decides when the caches
+        are pushed to the database.  If not supplied, a default policy
+        limited to event_cache_size events is used.
+        :param loader: The loader used to write the cached rows to the
+        database.  If not supplied, a COPY based loader is used on
+        PostgreSQL and bulk_create everywhere else.
+        :param pipelined: defaults to False.  If True, the XML is parsed
+        into events on a background thread while this thread handles the
+        events and flushes the caches so that parsing and database work
+        overlap.  All database work stays on the calling thread and inside
+        the parse transaction.
         """
         super().__init__(stream)
+        self.batch_entries = batch_entries
+        self.flush_policy = flush_policy or FlushPolicy(max_events=event_cache_size)
+        self.loader = loader or get_loader()
+        self.pipelined = pipelined
+        self.cached_event_count = 0
+        self._event_time_source = None
+        self._event_time = None
         self.event_cache = {}
         self.entry_cache = {}
         self.quantity_element_cache = []
@@ -73,10 +122,44 @@ class QuartetParser(FlexibleNSParser):
         """
         self._message = headers.Message()
         self._message.save()
-        super().parse()
+        if self.pipelined:
+            self._parse_pipelined()
+        else:
+            super().parse()
         self.clear_cache()
         return self._message.id
 
+    def _parse_pipelined(self):
+        """
+        Starts a QueueingParser on a background thread and handles the
+        events it produces as they arrive.  The queue is bounded by
+        pipeline_depth batches so the reader can only get so far ahead.
+        """
+        work_queue = queue.Queue(maxsize=self.pipeline_depth)
+        reader = QueueingParser(
+            self.stream,
+            work_queue,
+            self.header_namespace,
+            batch_size=self.pipeline_batch_size,
+        )
+        thread = threading.Thread(
+            target=reader.run, name="epcis-reader", daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                batch = work_queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for handler, item in batch:
+                    getattr(self, handler)(item)
+                    self.check_flush_policy()
+        finally:
+            reader.stop()
+            thread.join()
+
     def handle_sbdh(self, header: template_sbdh.StandardBusinessDocumentHeader):
         db_header = headers.SBDH()
         db_header.message = self._message
@@ -131,8 +214,6 @@ class QuartetParser(FlexibleNSParser):
             self.handle_top_level_id(epcis_event.parent_id, db_event)
         self.handle_common_elements(db_event, epcis_event)
         self._append_event_to_cache(db_event)
-        if len(self.event_cache) >= self.event_cache_size:
-            self.clear_cache()
         return db_event
 
     def handle_top_level_id(self, top_id, db_event):
@@ -281,53 +362,21 @@ class QuartetParser(FlexibleNSParser):
         :return:
         """
         logging.debug("Processing epc list %s", epc_list)
+        if self.batch_entries:
+            self._handle_entries_batch(db_event, epc_list, epcis_event, output)
+            return
+        event_time = self._get_event_time(epcis_event)
         for epc in epc_list:
             created = False
             entry = self.entry_cache.get(epc)
-            if (
-                entry
-                and isinstance(epcis_event, yes_events.ObjectEvent)
-                and epcis_event.action == yes_events.Action.add.value
-            ):
-                raise errors.CommissioningError(
-                    "The epc %s has already been commissioned.", epc
-                )
-            if (
-                entry
-                and entry.last_event_time == None
-                and isinstance(epcis_event, yes_events.AggregationEvent)
-            ):
-                raise errors.CommissioningError(
-                    "The epc %s has not been "
-                    "commissioned and therefore "
-                    "cannot be aggregated." % epc
-                )
-            if not entry:
+            cached = entry is not None
+            if not cached:
                 entry, created = entries.Entry.objects.get_or_create(
                     identifier=epc, decommissioned=False
                 )
-            if (
-                not created
-                and isinstance(epcis_event, yes_events.ObjectEvent)
-                and epcis_event.action == yes_events.Action.add.value
-            ):
-                raise errors.CommissioningError(
-                    "The epc %s has already been commissioned.", epc
-                )
-            # if an event is out of order but not an observation then throw
-            # an out of order exception
-            event_time = self.get_event_time(epcis_event)
-            if (
-                not created
-                and event_time < entry.last_event_time
-                and db_event.action != yes_events.Action.observe.value
-            ):
-                raise self.EventOrderException(
-                    _(
-                        "An event was received which was temporally "
-                        "out of order.  Event ID: %s" % epcis_event.event_id
-                    )
-                )
+            self._validate_entry(
+                epc, entry, created, cached, db_event, epcis_event, event_time
+            )
             # set the last event pointers
             entry.last_event = db_event
             entry.last_event_time = event_time
@@ -347,6 +396,141 @@ class QuartetParser(FlexibleNSParser):
             )
             self.entry_event_cache.append(entryevent)
 
+    def _validate_entry(
+        self,
+        epc: str,
+        entry: entries.Entry,
+        created: bool,
+        cached: bool,
+        db_event: events.Event,
+        epcis_event: yes_events.EPCISEvent,
+        event_time,
+    ):
+        """
+        Applies the commissioning and event order rules to a single epc
+        before its last event pointers are updated.
+        :param epc: The epc being processed.
+        :param entry: The Entry for the epc.
+        :param created: Whether the entry is new to this event.
+        :param cached: Whether the entry came from the entry cache.
+        :param db_event: The Event model instance.
+        :param epcis_event: The EPCPyYes event being processed.
+        :param event_time: The time of the event being processed.
+        """
+        if (
+            not created
+            and isinstance(epcis_event, yes_events.ObjectEvent)
+            and epcis_event.action == yes_events.Action.add.value
+        ):
+            raise errors.CommissioningError(
+                "The epc %s has already been commissioned.", epc
+            )
+        if (
+            cached
+            and entry.last_event_time is None
+            and isinstance(epcis_event, yes_events.AggregationEvent)
+        ):
+            raise errors.CommissioningError(
+                "The epc %s has not been "
+                "commissioned and therefore "
+                "cannot be aggregated." % epc
+            )
+        # if an event is out of order but not an observation then throw
+        # an out of order exception
+        if (
+            not created
+            and event_time < entry.last_event_time
+            and db_event.action != yes_events.Action.observe.value
+        ):
+            raise self.EventOrderException(
+                _(
+                    "An event was received which was temporally "
+                    "out of order.  Event ID: %s" % epcis_event.event_id
+                )
+            )
+
+    def _handle_entries_batch(
+        self,
+        db_event: events.Event,
+        epc_list: [],
+        epcis_event: yes_events.EPCISEvent,
+        output: bool = False,
+    ):
+        """
+        Applies the same rules as handle_entries but resolves the whole
+        epc list with one query, creates any new entries with a single
+        bulk insert and updates the existing entries with a single bulk
+        update.
+        :param db_event: The Event model instance.
+        :param epc_list: A list of epcs to be cached.
+        :param epcis_event: The EPCPyYes event being processed.
+        :param output: Whether or not the epcs are transformation outputs.
+        """
+        db_entries = self._resolve_entries(epc_list)
+        event_time = self._get_event_time(epcis_event)
+        new_entries = []
+        updated_entries = {}
+        for epc in epc_list:
+            created = False
+            entry = self.entry_cache.get(epc)
+            cached = entry is not None
+            if not cached:
+                entry = db_entries.get(epc)
+                if not entry:
+                    entry = entries.Entry(identifier=epc, decommissioned=False)
+                    created = True
+            self._validate_entry(
+                epc, entry, created, cached, db_event, epcis_event, event_time
+            )
+            entry.last_event = db_event
+            entry.last_event_time = event_time
+            entry.last_disposition = epcis_event.disposition
+            self._check_for_aggregation(db_event, entry, epcis_event)
+            if created:
+                new_entries.append(entry)
+            else:
+                updated_entries[entry.identifier] = entry
+            self.entry_cache[entry.identifier] = entry
+            entryevent = entries.EntryEvent(
+                entry=entry,
+                event_time=epcis_event.event_time,
+                event_type=db_event.type,
+                event=db_event,
+                identifier=epc,
+                output=output,
+            )
+            self.entry_event_cache.append(entryevent)
+        entries.Entry.objects.bulk_create(new_entries)
+        self._update_entries(list(updated_entries.values()))
+
+    def _resolve_entries(self, epc_list: list) -> dict:
+        """
+        Looks up any epcs that are not already in the entry cache with a
+        single query.
+        :param epc_list: The epcs to resolve.
+        :return: A dictionary of Entry model instances keyed by identifier.
+        """
+        missing = [epc for epc in epc_list if epc not in self.entry_cache]
+        if not missing:
+            return {}
+        db_entries = entries.Entry.objects.filter(
+            identifier__in=missing, decommissioned=False
+        )
+        return {db_entry.identifier: db_entry for db_entry in db_entries}
+
+    def _update_entries(self, db_entries: list):
+        """
+        Writes the entry_update_fields of each of the entries back to the
+        database using a single bulk update.
+        :param db_entries: The Entry model instances to update.
+        """
+        if db_entries:
+            entries.Entry.objects.bulk_update(
+                db_entries,
+                fields=self.entry_update_fields,
+                batch_size=self.entry_update_batch_size,
+            )
+
     def get_event_time(self, epcis_event: yes_events.EPCISEvent) -> datetime:
         """
         Override to get a valid event time for a given event if you are
@@ -354,8 +538,18 @@ class QuartetParser(FlexibleNSParser):
         :param epcis_event: The event with the event time to convert.
         :return: A datetime representing the EPCIS event event time string.
         """
-        event_time = parse_date(epcis_event.event_time)
-        return event_time
+        return parse_event_time(epcis_event.event_time)
+
+    def _get_event_time(self, epcis_event: yes_events.EPCISEvent) -> datetime:
+        """
+        Returns the event time for the event currently being parsed.  The
+        event time is only converted once per event regardless of how many
+        EPCs are in the event.
+        """
+        if self._event_time_source is not epcis_event:
+            self._event_time = self.get_event_time(epcis_event)
+            self._event_time_source = epcis_event
+        return self._event_time
 
     def _check_for_aggregation(self, db_event, entry, epcis_event):
         """
@@ -372,7 +566,7 @@ class QuartetParser(FlexibleNSParser):
             and db_event.action != yes_events.Action.observe.value
         ):
             entry.last_aggregation_event = db_event
-            entry.last_aggregation_event_time = epcis_event.event_time
+            entry.last_aggregation_event_time = self._get_event_time(epcis_event)
             entry.last_aggregation_event_action = epcis_event.action
 
     def handle_error_declaration(
@@ -499,9 +693,53 @@ class QuartetParser(FlexibleNSParser):
             self.destination_event_cache.append(destination_event)
             self.destination_cache.append(dest)
 
+    @property
+    def cached_entry_count(self) -> int:
+        """
+        The number of Entry records currently held in memory.
+        """
+        return len(self.entry_cache)
+
+    @property
+    def cached_row_count(self) -> int:
+        """
+        The total number of rows waiting to be written to the database
+        across all of the caches.
+        """
+        return (
+            self.cached_event_count
+            + self.cached_entry_count
+            + len(self.entry_event_cache)
+            + len(self.quantity_element_cache)
+            + len(self.error_declaration_cache)
+            + len(self.business_transaction_cache)
+            + len(self.ilmd_cache)
+            + len(self.source_cache)
+            + len(self.destination_cache)
+            + len(self.source_event_cache)
+            + len(self.destination_event_cache)
+        )
+
+    def clear_element(self, element):
+        """
+        Called by the XML parser once an element has been handled.  Since
+        this happens after every event, the flush policy is checked here.
+        """
+        super().clear_element(element)
+        self.check_flush_policy()
+
+    def check_flush_policy(self):
+        """
+        Flushes the caches to the database if any of the limits of the
+        flush policy have been reached.
+        """
+        if self.flush_policy.should_flush(self):
+            self.clear_cache()
+
     def clear_cache(self):
         """
-        Calls save on all items in all of the caches.
+        Writes all items in all of the caches to the database using the
+        parser's loader.
         """
         logger.debug(
             "Clear cache has been called with %s and %i "
@@ -510,44 +748,45 @@ class QuartetParser(FlexibleNSParser):
             len(self.entry_cache),
         )
         event_cache = self._get_sorted_event_cache()
-        events.Event.objects.bulk_create(event_cache)
+        self.loader.load(events.Event, event_cache)
         logger.debug(
             "Clearing out %s number of EntryEvents.", len(self.entry_event_cache)
         )
-        entries.EntryEvent.objects.bulk_create(self.entry_event_cache)
+        self.loader.load(entries.EntryEvent, self.entry_event_cache)
         logger.debug(
             "Clearing cache of %s number of quantity elements",
             len(self.quantity_element_cache),
         )
-        events.QuantityElement.objects.bulk_create(self.quantity_element_cache)
+        self.loader.load(events.QuantityElement, self.quantity_element_cache)
         logger.debug(
             "Clearing cache of %s number of error declarations",
             len(self.error_declaration_cache),
         )
-        events.ErrorDeclaration.objects.bulk_create(self.error_declaration_cache)
+        self.loader.load(events.ErrorDeclaration, self.error_declaration_cache)
         logger.debug(
             "Clearing the biz transaction cache of %s transactions",
             len(self.business_transaction_cache),
         )
-        events.BusinessTransaction.objects.bulk_create(self.business_transaction_cache)
+        self.loader.load(events.BusinessTransaction, self.business_transaction_cache)
         logger.debug("Clearing the ILMD cache of %s objects", len(self.ilmd_cache))
-        events.InstanceLotMasterData.objects.bulk_create(self.ilmd_cache)
+        self.loader.load(events.InstanceLotMasterData, self.ilmd_cache)
         logger.debug(
             "Clearing out the source cache of %s items", len(self.source_cache)
         )
-        events.Source.objects.bulk_create(self.source_cache)
+        self.loader.load(events.Source, self.source_cache)
         logger.debug(
             "Clearing out the destination cache of %s items",
             len(self.destination_cache),
         )
-        events.Destination.objects.bulk_create(self.destination_cache)
+        self.loader.load(events.Destination, self.destination_cache)
         logger.debug("Clearing out the source event cache.")
-        events.SourceEvent.objects.bulk_create(self.source_event_cache)
+        self.loader.load(events.SourceEvent, self.source_event_cache)
         logger.debug("Clearing out the destination event cache.")
-        events.DestinationEvent.objects.bulk_create(self.destination_event_cache)
+        self.loader.load(events.DestinationEvent, self.destination_event_cache)
         logger.debug("Clearing out the cache lists.")
         self.event_cache.clear()
-        self.entry_cache.clear()
+        self.cached_event_count = 0
+        self._clear_entry_cache()
         del self.entry_event_cache[:]
         del self.error_declaration_cache[:]
         del self.quantity_element_cache[:]
@@ -558,6 +797,13 @@ class QuartetParser(FlexibleNSParser):
         del self.source_event_cache[:]
         del self.destination_event_cache[:]
 
+    def _clear_entry_cache(self):
+        """
+        Called at the end of clear_cache.  Override to keep entries in
+        memory between flushes.
+        """
+        self.entry_cache.clear()
+
     def _append_event_to_cache(self, db_event):
         """
         The internal event cache is a dictionary with a key that has
@@ -574,6 +820,7 @@ class QuartetParser(FlexibleNSParser):
             self.event_cache[db_event.event_time] = event_list
         # add the event to the existing or new list (by reference)
         event_list.append(db_event)
+        self.cached_event_count += 1
 
     def _get_sorted_event_cache(self):
         # get the dates
@@ -0,0 +1,128 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2018 SerialLab Corp.  All rights reserved.
+import logging
+import queue
+import threading
+
+from eparsecis.eparsecis import FlexibleNSParser
+from EPCPyYes.core.v1_2 import template_events
+from EPCPyYes.core.SBDH import template_sbdh
+
+logger = logging.getLogger(__name__)
+
+
+class QueueingParser(FlexibleNSParser):
+    """
+    Parses EPCIS XML into EPCPyYes events and places them, in document
+    order, onto a bounded queue in batches.  Meant to be run on a
+    background thread by the `run` method while another thread consumes
+    the queue and does the database work.  No database access takes
+    place in this class.
+
+    Each item put on the queue is one of the following:
+
+    * a list of (handler name, EPCPyYes object) tuples
+    * an exception raised while parsing
+    * None once the document has been fully parsed
+    """
+
+    def __init__(
+        self,
+        stream,
+        work_queue: queue.Queue,
+        header_namespace="http://www.unece.org/cefact/namespaces"
+        "/StandardBusinessDocumentHeader",
+        batch_size: int = 64,
+    ):
+        """
+        :param stream: The EPCIS stream to parse.
+        :param work_queue: The queue to place batches of events on.  Give
+        the queue a maxsize so that parsing blocks when the consumer falls
+        behind.
+        :param header_namespace: The SBDH namespace.
+        :param batch_size: The number of events in each batch.
+        """
+        super().__init__(stream, header_namespace)
+        self.work_queue = work_queue
+        self.batch_size = batch_size
+        self.batch = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        """
+        Parses the stream and queues the results.  Any exception is put on
+        the queue for the consumer to raise.
+        """
+        try:
+            super().parse()
+            self._put_batch()
+            self._put(None)
+        except self.ReaderStopped:
+            logger.debug("The background EPCIS reader was stopped.")
+        except Exception as e:
+            logger.exception("The background EPCIS reader failed.")
+            try:
+                self._put(e)
+            except self.ReaderStopped:
+                pass
+
+    def stop(self):
+        """
+        Tells the reader to stop putting items on the queue.  Called by the
+        consumer when it is done, including when it fails part way through.
+        """
+        self.stopped.set()
+
+    def handle_sbdh(self, header: template_sbdh.StandardBusinessDocumentHeader):
+        self._add("handle_sbdh", header)
+
+    def handle_object_event(self, epcis_event: template_events.ObjectEvent):
+        self._add("handle_object_event", epcis_event)
+
+    def handle_aggregation_event(self, epcis_event: template_events.AggregationEvent):
+        self._add("handle_aggregation_event", epcis_event)
+
+    def handle_transaction_event(self, epcis_event: template_events.TransactionEvent):
+        self._add("handle_transaction_event", epcis_event)
+
+    def handle_transformation_event(
+        self, epcis_event: template_events.TransformationEvent
+    ):
+        self._add("handle_transformation_event", epcis_event)
+
+    def _add(self, handler: str, item):
+        if self.stopped.is_set():
+            raise self.ReaderStopped()
+        self.batch.append((handler, item))
+        if len(self.batch) >= self.batch_size:
+            self._put_batch()
+
+    def _put_batch(self):
+        if self.batch:
+            self._put(self.batch)
+            self.batch = []
+
+    def _put(self, item):
+        # wait for room on the queue but give up if the consumer has gone
+        while not self.stopped.is_set():
+            try:
+                self.work_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise self.ReaderStopped()
+
+    class ReaderStopped(Exception):
+        pass
@@ -13,7 +13,12 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
-from rest_framework.serializers import ModelSerializer
+import datetime
+from django.db.models import F
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import ParseError
+from rest_framework.fields import DateTimeField
+from rest_framework.serializers import BaseSerializer, ModelSerializer
 from quartet_epcis.models import entries, events, headers
 
 
@@ -89,6 +94,96 @@ class DestinationEventSerializer(ModelSerializer):
         fields = '__all__'
 
 
+class ValuesSerializer(BaseSerializer):
+    '''
+    A read only serializer for the dictionaries returned by a queryset's
+    values() call.  Used by the viewsets to list rows without building a
+    model instance and a set of serializer fields for each one.
+
+    The fields are the model's concrete fields (foreign keys as their
+    primary key values, as with a ModelSerializer) plus any `expansions`,
+    which are extra values looked up through a join- for example the
+    identifier of an Entry's parent.
+    '''
+    model = None
+    # output name: lookup for the values that are only added on request
+    expansions = {}
+
+    _datetime_field = DateTimeField()
+
+    def __init__(self, *args, **kwargs):
+        '''
+        :param fields: The names of the values to output.  Defaults to all
+        of the model's fields.
+        '''
+        self.field_names = kwargs.pop('fields', None) or \
+                           self.get_model_fields()
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def get_model_fields(cls) -> list:
+        return [field.name for field in cls.model._meta.concrete_fields]
+
+    @classmethod
+    def get_field_names(cls, fields: str = None, expand: str = None) -> list:
+        '''
+        Returns the names of the values to output for the `fields` and
+        `expand` query parameters.
+        :param fields: A comma separated list of field and expansion names
+        for a sparse response.  All of the model's fields if empty.
+        :param expand: A comma separated list of expansions to add to the
+        fields.
+        :return: A list of field names.
+        '''
+        allowed = cls.get_model_fields() + list(cls.expansions)
+        field_names = [name.strip() for name in (fields or '').split(',')
+                       if name.strip()] or cls.get_model_fields()
+        field_names += [name.strip() for name in (expand or '').split(',')
+                        if name.strip() and name.strip() not in field_names]
+        unknown = [name for name in field_names if name not in allowed]
+        if unknown:
+            raise ParseError(
+                _('Unknown fields: %s.  The fields available are %s.') % (
+                    ', '.join(unknown), ', '.join(allowed)))
+        return field_names
+
+    @classmethod
+    def get_values(cls, queryset, field_names):
+        '''
+        Returns the queryset's values for the field names, joining in any
+        expansions.
+        '''
+        names = [name for name in field_names if name not in cls.expansions]
+        lookups = {name: F(cls.expansions[name]) for name in field_names
+                   if name in cls.expansions}
+        return queryset.values(*names, **lookups)
+
+    def to_representation(self, instance):
+        ret = {}
+        for name in self.field_names:
+            value = instance[name]
+            if isinstance(value, datetime.datetime):
+                value = self._datetime_field.to_representation(value)
+            ret[name] = value
+        return ret
+
+
+class EntryValuesSerializer(ValuesSerializer):
+    model = entries.Entry
+    expansions = {
+        'parent': 'parent_id__identifier',
+        'top': 'top_id__identifier',
+    }
+
+
+class EntryEventValuesSerializer(ValuesSerializer):
+    model = entries.EntryEvent
+
+
+class EventValuesSerializer(ValuesSerializer):
+    model = events.Event
+
+
 class MessageSerializer(ModelSerializer):
     class Meta:
         model = headers.Message
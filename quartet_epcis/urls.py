@@ -62,6 +62,7 @@ urlpatterns = [
         views.MessageDetail.as_view(),
         name="message",
     ),
+    re_path(r"^entry-status/?$", views.EntryStatusView.as_view(), name="entry-status"),
 ]
 
 urlpatterns += router.urls
@@ -12,17 +12,31 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
+import datetime
+import itertools
+import json
 import logging
 from typing import List
 from gettext import gettext as _
 
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.text import compress_sequence
 from rest_framework import views
+from rest_framework.permissions import DjangoModelPermissions, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.request import Request
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
 from rest_framework import status
+from rest_framework.utils.urls import replace_query_param
 from EPCPyYes.core.v1_2 import template_events
 from quartet_epcis.db_api.queries import EPCISDBProxy
+from quartet_epcis.db_api.writers import EPCISDocumentWriter, \
+    EPCISJSONDocumentWriter
 from quartet_epcis.models import events, headers, entries
 from quartet_epcis.renderers import EPCPyYesXMLRenderer
 
@@ -41,15 +55,118 @@ class FormatHelperMixin:
 
     def get_formatted_data(self, request: Request, template_event,
                            format=None):
-        if 'xml' in request.content_type.lower() or \
-            'xml' in request.query_params.get('format', '') or \
-            format == 'xml':
+        if self.is_xml(request, format):
             response_data = template_event.render()
         else:
             # else render JSON
             response_data = template_event.render_dict()
         return response_data
 
+    def is_xml(self, request: Request, format=None):
+        return 'xml' in request.content_type.lower() or \
+            'xml' in request.query_params.get('format', '') or \
+            format == 'xml'
+
+    # the largest page_size a client may ask for
+    max_page_size = 1000
+
+    def get_page_args(self, request: Request):
+        '''
+        Returns the page_size and cursor keyword arguments for the
+        EPCISDBProxy if the request asked for a page of events by way of the
+        `page_size` or `cursor` query parameters or the
+        QUARTET_EPCIS_EVENT_PAGE_SIZE setting is set.  Otherwise returns an
+        empty dictionary.
+        '''
+        page_size = request.query_params.get(
+            'page_size',
+            getattr(settings, 'QUARTET_EPCIS_EVENT_PAGE_SIZE', None)
+        )
+        cursor = request.query_params.get('cursor')
+        if not page_size and not cursor:
+            return {}
+        try:
+            page_size = int(page_size or self.max_page_size)
+        except ValueError:
+            raise ParseError(_('The page_size must be a number.'))
+        if page_size < 1:
+            raise ParseError(_('The page_size must be greater than zero.'))
+        return {'page_size': min(page_size, self.max_page_size),
+                'cursor': cursor}
+
+    def add_next_link(self, request: Request, response, pyyes_events):
+        '''
+        Adds a Link header pointing to the next page of events if the
+        events are an EventPage with a next page.
+        '''
+        next_cursor = getattr(pyyes_events, 'next_cursor', None)
+        if next_cursor:
+            url = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                      next_cursor)
+            response['Link'] = '<%s>; rel="next"' % url
+        return response
+
+    def get_time_args(self, request: Request):
+        '''
+        Returns the start_time and end_time keyword arguments for the
+        EPCISDBProxy from the ISO 8601 `start_time` and `end_time` query
+        parameters.  Times without an offset are taken as UTC.
+        '''
+        ret = {}
+        for name in ('start_time', 'end_time'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    ret[name] = parse_datetime(value)
+                except ValueError:
+                    ret[name] = None
+                if not ret[name]:
+                    raise ParseError(
+                        _('The %s must be an ISO 8601 date and time.') % name)
+                if timezone.is_naive(ret[name]):
+                    ret[name] = timezone.make_aware(ret[name],
+                                                    datetime.timezone.utc)
+        return ret
+
+    def stream_requested(self, request: Request):
+        '''
+        Whether or not the request asked for a streaming response by
+        way of the `stream` query parameter.
+        '''
+        return request.query_params.get('stream', '').lower() in (
+            'true', '1', 'yes')
+
+    def get_streaming_response(self, request: Request, pyyes_events,
+                               header=None, format=None):
+        '''
+        Writes the EPCPyYes events out as an XML or JSON EPCIS document
+        a piece at a time through a StreamingHttpResponse so that large
+        documents never have to be held in memory.  The content is
+        gzipped if the client accepts gzip encoding.
+        :param request: The HTTP request.
+        :param pyyes_events: An iterable of EPCPyYes events with any
+        transformation events last.
+        :param header: An optional EPCPyYes SBDH.
+        :param format: json or xml
+        :return: A StreamingHttpResponse.
+        '''
+        if self.is_xml(request, format):
+            writer = EPCISDocumentWriter(header)
+            content_type = 'application/xml'
+        else:
+            writer = EPCISJSONDocumentWriter(header)
+            content_type = 'application/json'
+        content = (text.encode('utf-8') for text in writer.write(pyyes_events))
+        gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if gzipped:
+            content = compress_sequence(content)
+        response = StreamingHttpResponse(
+            content, content_type='%s; charset=utf-8' % content_type)
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
 
 class EventDetailView(views.APIView, FormatHelperMixin):
     # sentinal queryset for rights management
@@ -117,18 +234,38 @@ class EntryEventHistoryView(views.APIView, FormatHelperMixin):
         :param entry_pk: The entry primary key.
         :param entry_identifier: The entry identifier.
         :return: A series of XML or JSON structures representing the events
-        associated with the inbound id.
+        associated with the inbound id.  Add `stream=true` to the query
+        parameters to have the document streamed back or `page_size` to
+        get the events a page at a time.  When there are more pages, the
+        `Link` response header holds the URL of the next one.  The
+        `start_time` and `end_time` query parameters limit the events to
+        a time range.
 
         '''
         args = {'epc_pk': entry_pk} if entry_pk else {
             'epc': entry_identifier}
+        time_args = self.get_time_args(request)
+        page_args = self.get_page_args(request)
+        if self.stream_requested(request) and not page_args:
+            pyyes_events = proxy.iter_events_by_epc(**args, **time_args)
+            first = next(pyyes_events, None)
+            if first:
+                return self.get_streaming_response(
+                    request, itertools.chain([first], pyyes_events), format=format)
+            raise NotFound(_('The entry with id %s could not be found.' % \
+                             str(args)))
         # get a list of EPCPyYes events from the DB proxy
-        events = proxy.get_events_by_epc(**args)
+        try:
+            events = proxy.get_events_by_epc(**args, **page_args, **time_args)
+        except ValueError as e:
+            raise ParseError(str(e))
         if len(events) > 0:
-            epcis_document = template_events.EPCISEventListDocument(events)
+            epcis_document = template_events.EPCISEventListDocument(
+                list(events))
             response_data = self.get_formatted_data(request, epcis_document,
                                                     format)
-            return Response(response_data, status.HTTP_200_OK)
+            return self.add_next_link(
+                request, Response(response_data, status.HTTP_200_OK), events)
         else:
             raise NotFound(_('The entry with id %s could not be found.' % \
                              str(args)))
@@ -137,20 +274,27 @@ class EntryEventHistoryView(views.APIView, FormatHelperMixin):
 class EventsByILMDView(views.APIView, FormatHelperMixin):
     '''
     Gets all events associated with an ILMD name and value pair.
-    For example Lot:2233
+    For example Lot:2233.  Supports the same `page_size` and `cursor`
+    query parameters as the EntryEventHistoryView.
     '''
     queryset = events.Event.objects.none()
 
     def get(self, request: Request, format=None, ilmd_name=None,
             ilmd_value=None):
-        pyyes_events = proxy.get_events_by_ilmd(ilmd_name, ilmd_value)
+        try:
+            pyyes_events = proxy.get_events_by_ilmd(
+                ilmd_name, ilmd_value, **self.get_page_args(request))
+        except ValueError as e:
+            raise ParseError(str(e))
         if len(pyyes_events) > 0:
             epcis_document = template_events.EPCISEventListDocument(
-                pyyes_events)
+                list(pyyes_events))
             response_data = self.get_formatted_data(request,
                                                     epcis_document,
                                                     format=format)
-            return Response(response_data, status.HTTP_200_OK)
+            return self.add_next_link(
+                request, Response(response_data, status.HTTP_200_OK),
+                pyyes_events)
         else:
             msg = _('No events could be found that match name %s ' \
                     'and value %s' % (ilmd_name, ilmd_value))
@@ -167,14 +311,98 @@ class MessageDetail(views.APIView, FormatHelperMixin):
     def get(self, request: Request, format=None, message_id=None):
         '''
         Returns a full EPCIS message based on the inbpund message id.
+        The message is streamed back if `stream=true` is in the query
+        parameters or if it has more events than the
+        QUARTET_EPCIS_STREAMING_THRESHOLD setting (if set).
         '''
         # get the message
         try:
             db_message = headers.Message.objects.get(id=message_id)
+            if self.should_stream(request, db_message):
+                return self.get_streaming_response(
+                    request,
+                    proxy.iter_message_events(db_message),
+                    header=proxy.get_message_header(db_message),
+                    format=format
+                )
             message = proxy.get_full_message(db_message)
             return Response(self.get_formatted_data(request, message))
         except headers.Message.DoesNotExist:
             found_message_id = 'The message with id %s could not ' \
                                'be found' % message_id
-            logger.debug()
+            logger.debug(found_message_id)
             raise NotFound(found_message_id)
+
+    def should_stream(self, request: Request, db_message: headers.Message):
+        if self.stream_requested(request):
+            return True
+        threshold = getattr(settings, 'QUARTET_EPCIS_STREAMING_THRESHOLD',
+                            None)
+        return bool(threshold) and events.Event.objects.filter(
+            message_id=db_message.id).count() > threshold
+
+
+class LookupModelPermissions(DjangoModelPermissions):
+    '''
+    For views that take a POST to look things up rather than to create
+    them: a POST only needs the view permission for the model.
+    '''
+    perms_map = dict(DjangoModelPermissions.perms_map,
+                     POST=['%(app_label)s.view_%(model_name)s'])
+
+
+class EntryStatusView(views.APIView):
+    '''
+    Returns the status of a list of entries in one request.
+    '''
+    # sentinal queryset for permissions
+    queryset = entries.Entry.objects.none()
+    permission_classes = (IsAuthenticated, LookupModelPermissions)
+
+    def post(self, request: Request, format=None):
+        '''
+        Accepts a JSON list of EPCs (entry identifiers), or an object with
+        the list in an `epcs` field, and streams back a JSON list with the
+        status of each.  At most QUARTET_EPCIS_MAX_STATUS_EPCS (10000 by
+        default) EPCs may be posted at a time.
+
+        .. code-block:: text
+
+            POST http[s]:/[hostname]:[port]/epcis/entry-status/
+            ["urn:epc:id:sgtin:305555.0555555.1", ...]
+
+            [{"identifier": "urn:epc:id:sgtin:305555.0555555.1",
+              "commissioned": true, "decommissioned": false,
+              "last_disposition": "urn:epcglobal:cbv:disp:in_progress",
+              "last_event_time": "2018-01-22T22:51:49.294565+00:00",
+              "parent_id": "urn:epc:id:sgtin:305555.3555555.1",
+              "top_id": "urn:epc:id:sgtin:305555.3555555.1"}, ...]
+
+        EPCs that are not in the database have a `commissioned` value
+        of false.
+        '''
+        epcs = request.data
+        if isinstance(epcs, dict):
+            epcs = epcs.get('epcs')
+        if not isinstance(epcs, list) or not epcs or \
+            not all(isinstance(epc, str) for epc in epcs):
+            raise ValidationError(_('A list of EPCs is required.'))
+        max_epcs = getattr(settings, 'QUARTET_EPCIS_MAX_STATUS_EPCS', 10000)
+        if len(epcs) > max_epcs:
+            raise ValidationError(
+                _('No more than %s EPCs may be looked up at a time.') %
+                max_epcs)
+        return StreamingHttpResponse(
+            self._write(proxy.iter_entry_statuses(epcs)),
+            content_type='application/json; charset=utf-8')
+
+    def _write(self, statuses):
+        yield '['
+        for i, entry_status in enumerate(statuses):
+            # formatted as in the events' eventTime
+            if entry_status['last_event_time']:
+                entry_status['last_event_time'] = \
+                    entry_status['last_event_time'].isoformat()
+            yield (', ' if i else '') + json.dumps(entry_status,
+                                                   cls=DjangoJSONEncoder)
+        yield ']'
@@ -14,37 +14,81 @@
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
 from rest_framework import viewsets
+from rest_framework.response import Response
 from quartet_epcis.models import events, entries, headers
 from quartet_epcis import serializers
 from django_filters.rest_framework.backends import DjangoFilterBackend
 
 from quartet_epcis.filters import EntrySearchFilter
-
-class EntryViewSet(viewsets.ModelViewSet):
+from quartet_epcis import pagination
+
+
+class ValuesListMixin:
+    '''
+    Lists the viewset's rows from the queryset's values() by way of the
+    values_serializer_class rather than the model serializer.  Supports
+    sparse responses with the `fields` query parameter and any of the
+    serializer's expansions with the `expand` query parameter, for
+    example `?fields=identifier,last_disposition&expand=parent`.
+    '''
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.values_serializer_class
+        field_names = serializer_class.get_field_names(
+            request.query_params.get('fields'),
+            request.query_params.get('expand'))
+        # the cursor paginators need the values they order on
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        value_names = list(field_names)
+        value_names += [name.lstrip('-') for name in ordering
+                        if name.lstrip('-') not in value_names]
+        queryset = serializer_class.get_values(
+            self.filter_queryset(self.get_queryset()), value_names)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = serializer_class(page, many=True, fields=field_names)
+            return self.get_paginated_response(serializer.data)
+        serializer = serializer_class(queryset, many=True, fields=field_names)
+        return Response(serializer.data)
+
+
+class EntryViewSet(ValuesListMixin, viewsets.ModelViewSet):
     '''
     The default viewset to handle the management of Entries.
     '''
     filter_backends = [EntrySearchFilter, DjangoFilterBackend]
     queryset = entries.Entry.objects.all()
     serializer_class = serializers.EntrySerializer
+    values_serializer_class = serializers.EntryValuesSerializer
     search_fields = ['=identifier',]
+    pagination_class = pagination.get_pagination_class(
+        pagination.EntryCursorPagination)
 
-class EntryEventViewSet(viewsets.ModelViewSet):
+class EntryEventViewSet(ValuesListMixin, viewsets.ModelViewSet):
     '''
     The default viewset to handle EntryEvents.
     '''
     queryset = entries.EntryEvent.objects.all()
-    serializer_class = serializers.EntrySerializer
+    serializer_class = serializers.EntryEventSerialzier
+    values_serializer_class = serializers.EntryEventValuesSerializer
+    pagination_class = pagination.get_pagination_class(
+        pagination.EntryEventCursorPagination)
 
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(ValuesListMixin, viewsets.ModelViewSet):
     '''
     The default viewset to handle Events.
     '''
     queryset = events.Event.objects.all()
     serializer_class = serializers.EventSerializer
+    values_serializer_class = serializers.EventValuesSerializer
     search_fields = ['=event_id',]
     filter_fields = '__all__'
+    pagination_class = pagination.get_pagination_class(
+        pagination.EventCursorPagination)
 
 
 class TransformationIDViewSet(viewsets.ModelViewSet):
@@ -13,14 +13,21 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 
+import io
 import os
 import logging
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from quartet_epcis.db_api.queries import EPCISDBProxy
 from quartet_epcis.models import events, choices, headers, entries
 from quartet_epcis.parsing import errors
 from quartet_epcis.parsing.parser import QuartetParser
 from quartet_epcis.parsing.context_parser import BusinessEPCISParser
+from quartet_epcis.parsing.cache import EntryCache
+from quartet_epcis.parsing.flush import FlushPolicy
+from quartet_epcis.parsing.loaders import BulkCreateLoader, CopyLoader, \
+    get_loader
 
 db_proxy = EPCISDBProxy()
 logger = logging.getLogger(__name__)
@@ -135,6 +142,70 @@ class BusinessRulesTestCase(TestCase):
         )
         self.assertEqual(db_entries.count(), 6)
 
+    def test_decommission_pallet(self):
+        '''
+        Decommissions a pallet and makes sure the cases and items beneath it
+        are decommissioned without a query per level or per entry.
+        '''
+        self._parse_test_data('data/commission.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        curpath = os.path.dirname(__file__)
+        with open(os.path.join(curpath,
+                               'data/recursive_decommission.xml')) as f:
+            data = f.read().replace('urn:epc:id:sgtin:305555.3555555.1',
+                                    'urn:epc:id:sgtin:305555.5555555.1')
+        parser = BusinessEPCISParser(io.BytesIO(data.encode()))
+        with CaptureQueriesContext(connection) as context:
+            message_id = parser.parse()
+        db_entries = entries.Entry.objects.filter(
+            top_id__identifier='urn:epc:id:sgtin:305555.5555555.1'
+        )
+        self.assertEqual(db_entries.count(), 12)
+        self.assertEqual(db_entries.filter(decommissioned=True).count(), 12)
+        self.assertTrue(entries.Entry.objects.get(
+            identifier='urn:epc:id:sgtin:305555.5555555.1').decommissioned)
+        self.assertEqual(entries.EntryEvent.objects.filter(
+            event__message_id=message_id).values(
+            'identifier').distinct().count(), 13)
+        selects = [query for query in context.captured_queries
+                   if query['sql'].startswith('SELECT')]
+        self.assertLess(len(selects), 5)
+
+    @override_settings(QUARTET_EPCIS_ENTRY_CLOSURE=True)
+    def test_entry_closure(self):
+        '''
+        Keeps the closure table up to date while packing, unpacking and
+        decommissioning and makes sure it always matches a full rebuild.
+        '''
+        def closure_rows():
+            return set(entries.EntryClosure.objects.values_list(
+                'ancestor__identifier', 'descendant__identifier', 'depth'))
+
+        def check_rebuild():
+            rows = closure_rows()
+            db_proxy.rebuild_closure()
+            self.assertEqual(rows, closure_rows())
+            return rows
+
+        self._parse_test_data('data/commission.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        self.assertEqual(len(check_rebuild()), 22)
+        pallet = entries.Entry.objects.get(
+            identifier='urn:epc:id:sgtin:305555.5555555.1')
+        case = entries.Entry.objects.get(
+            identifier='urn:epc:id:sgtin:305555.3555555.1')
+        item = entries.Entry.objects.filter(parent_id=case).first()
+        self.assertEqual(db_proxy.get_descendants([pallet]).count(), 12)
+        self.assertEqual(db_proxy.get_ancestors(item), [case, pallet])
+        self.assertEqual(
+            len(db_proxy.get_aggregation_parents_by_epcs([pallet])), 3)
+        self._parse_test_data('data/unpack_top.xml')
+        rows = check_rebuild()
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(db_proxy.get_descendants([pallet]).count(), 0)
+        self._parse_test_data('data/recursive_decommission.xml')
+        self.assertEqual(len(check_rebuild()), 5)
+
     def test_flat_decommission(self):
         '''
         Decommissions six entries and then verifies.
@@ -469,6 +540,279 @@ class BusinessRulesTestCase(TestCase):
         parser.stream = self._get_stream('data/repack_item.xml')
         parser.parse()
 
+    def test_batch_entry_resolution(self):
+        '''
+        Commissions with and without batched entry resolution and makes
+        sure both produce the same entries while the batched mode uses
+        far fewer queries.
+        '''
+        curpath = os.path.dirname(__file__)
+        parser = QuartetParser(os.path.join(curpath, 'data/commission.xml'),
+                               batch_entries=False)
+        with CaptureQueriesContext(connection) as unbatched:
+            parser.parse()
+        unbatched_entries = set(
+            entries.Entry.objects.values_list('identifier', 'last_disposition')
+        )
+        entries.EntryEvent.objects.all().delete()
+        entries.Entry.objects.all().delete()
+        parser = QuartetParser(os.path.join(curpath, 'data/commission.xml'))
+        with CaptureQueriesContext(connection) as batched:
+            parser.parse()
+        batched_entries = set(
+            entries.Entry.objects.values_list('identifier', 'last_disposition')
+        )
+        self.assertEqual(unbatched_entries, batched_entries)
+        self.assertEqual(len(batched_entries), 13)
+        self.assertLess(len(batched), len(unbatched))
+        with self.assertRaises(errors.CommissioningError):
+            self._parse_test_data('data/commission.xml',
+                                  parser_type=QuartetParser)
+
+    def test_bulk_entry_flush(self):
+        '''
+        Packs items to cases and cases to a pallet and makes sure the
+        entries are written back with a few bulk updates rather than one
+        update per entry.
+        '''
+        self._parse_test_data('data/commission.xml')
+        with CaptureQueriesContext(connection) as context:
+            self._parse_test_data('data/nested_pack.xml')
+        updates = [query for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE "quartet_epcis_entry"')]
+        self.assertLess(len(updates), 5)
+        palet = entries.Entry.objects.get(
+            identifier='urn:epc:id:sgtin:305555.5555555.1'
+        )
+        self.assertTrue(palet.is_parent)
+        self.assertEqual(
+            entries.Entry.objects.filter(top_id=palet).count(), 12
+        )
+
+    def test_flush_policy(self):
+        '''
+        Flushes after every event and makes sure the hierarchy comes out
+        the same as it does with a single flush.
+        '''
+        curpath = os.path.dirname(__file__)
+        for test_file in ['data/commission.xml', 'data/nested_pack.xml']:
+            parser = BusinessEPCISParser(
+                os.path.join(curpath, test_file),
+                flush_policy=FlushPolicy(max_events=1)
+            )
+            parser.parse()
+            self.assertEqual(parser.cached_row_count, 0)
+        all_child = entries.Entry.objects.filter(
+            top_id__identifier='urn:epc:id:sgtin:305555.5555555.1'
+        )
+        self.assertEqual(all_child.count(), 12)
+        self.assertEqual(events.Event.objects.all().count(), 4)
+        self.assertEqual(entries.EntryEvent.objects.all().count(), 28)
+
+    def test_row_budget_flush(self):
+        '''
+        Makes sure the row limit of the flush policy triggers flushes
+        mid-message without losing any events.
+        '''
+        curpath = os.path.dirname(__file__)
+        parser = QuartetParser(
+            os.path.join(curpath, 'data/epcis.xml'),
+            flush_policy=FlushPolicy(max_events=None, max_entries=None,
+                                     max_rows=10)
+        )
+        flushes = []
+        clear_cache = parser.clear_cache
+        parser.clear_cache = lambda: flushes.append(clear_cache())
+        parser.parse()
+        self.assertGreater(len(flushes), 1)
+        self.assertEqual(events.Event.objects.all().count(), 4)
+
+    def test_entry_cache_survives_flush(self):
+        '''
+        Flushes after every event and makes sure the clean entries stay
+        cached between flushes so the pallet and cases are only read from
+        the database once.  Cached children must match the database once
+        their top has been propagated to them.
+        '''
+        self._parse_test_data('data/commission.xml')
+        curpath = os.path.dirname(__file__)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/nested_pack.xml'),
+            flush_policy=FlushPolicy(max_events=1),
+            recursive_child_update=True
+        )
+        sizes = []
+        fields = ('last_event_id', 'last_event_time', 'last_disposition')
+
+        def record_clear_cache(parser):
+            clear_cache = parser.clear_cache
+
+            def wrapper():
+                clear_cache()
+                sizes.append((len(parser.entry_cache),
+                              len(parser.entry_cache.dirty)))
+                for entry in list(parser.entry_cache.values()):
+                    cached = [getattr(entry, field) for field in fields]
+                    entry.refresh_from_db()
+                    self.assertEqual(
+                        cached, [getattr(entry, field) for field in fields])
+
+            parser.clear_cache = wrapper
+
+        record_clear_cache(parser)
+        parser.parse()
+        self.assertGreater(len(sizes), 1)
+        self.assertGreater(sizes[0][0], 0)
+        self.assertEqual(sizes[0][1], 0)
+        self.assertGreater(parser.entry_cache.hits, 0)
+        self.assertEqual(len(parser.entry_cache), 0)
+        all_child = entries.Entry.objects.filter(
+            top_id__identifier='urn:epc:id:sgtin:305555.5555555.1'
+        )
+        self.assertEqual(all_child.count(), 12)
+        # an item and then its pallet are observed in the same flush, the
+        # item is dirty when the pallet is propagated to it
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/observe_item_pallet.xml'),
+            recursive_child_update=True
+        )
+        record_clear_cache(parser)
+        parser.parse()
+        item = entries.Entry.objects.get(
+            identifier='urn:epc:id:sgtin:305555.0555555.1')
+        self.assertEqual(item.last_disposition,
+                         'urn:epcglobal:cbv:disp:in_transit')
+
+    def test_entry_cache_eviction(self):
+        '''
+        Only clean entries are evicted once the cache is full.
+        '''
+        a, b, c, d = [entries.Entry(identifier=identifier)
+                      for identifier in 'abcd']
+        cache = EntryCache(max_size=2)
+        cache.load('a', a)
+        cache['b'] = b
+        cache['c'] = c
+        self.assertEqual(list(cache.keys()), ['b', 'c'])
+        cache['d'] = d
+        self.assertEqual(len(cache), 3)
+        cache.mark_clean()
+        self.assertEqual(list(cache.keys()), ['c', 'd'])
+        self.assertEqual(cache.evictions, 2)
+        self.assertIs(cache.get('c'), c)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_entry_cache_child_index(self):
+        '''
+        The cache keeps track of the children of each parent as the parent
+        of an entry changes and forgets a parent is complete once one of
+        its children is evicted.
+        '''
+        parent, other = entries.Entry(identifier='p'), entries.Entry(
+            identifier='o')
+        children = [entries.Entry(identifier=str(i), parent_id=parent)
+                    for i in range(3)]
+        cache = EntryCache(max_size=3)
+        for child in children:
+            cache[child.identifier] = child
+        cache.mark_complete(parent.pk)
+        self.assertCountEqual(cache.get_children(parent.pk), children)
+        children[0].parent_id = other
+        cache[children[0].identifier] = children[0]
+        self.assertCountEqual(cache.get_children(parent.pk), children[1:])
+        self.assertEqual(cache.get_children(other.pk), [children[0]])
+        cache.pop(children[1].identifier)
+        self.assertEqual(cache.get_children(parent.pk), [children[2]])
+        self.assertIn(parent.pk, cache.complete)
+        cache.mark_clean()
+        cache.evict_where(lambda entry: entry.identifier == '2')
+        self.assertEqual(cache.get_children(parent.pk), [])
+        self.assertNotIn(parent.pk, cache.complete)
+
+    def test_child_lookup_from_cache(self):
+        '''
+        Once the children of a parent have been read they come from the
+        cache.
+        '''
+        self._parse_test_data('data/commission.xml')
+        self._parse_test_data('data/nested_pack.xml')
+        curpath = os.path.dirname(__file__)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/commission.xml')
+        )
+        pallet = parser._get_entry('urn:epc:id:sgtin:305555.5555555.1')
+        children = parser._get_child_entries(pallet)
+        self.assertEqual(len(children), 2)
+        with CaptureQueriesContext(connection) as context:
+            self.assertCountEqual(parser._get_child_entries(pallet),
+                                  children)
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_loader(self):
+        '''
+        Makes sure the parser writes its caches through the loader and that
+        the COPY loader formats rows as CSV with explicit NULLs.
+        '''
+        self.assertIsInstance(get_loader(), BulkCreateLoader)
+        loaded = {}
+
+        class RecordingLoader(BulkCreateLoader):
+            def load(self, model, objs):
+                loaded[model] = loaded.get(model, 0) + len(objs)
+                super().load(model, objs)
+
+        curpath = os.path.dirname(__file__)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/commission.xml'),
+            loader=RecordingLoader()
+        )
+        parser.parse()
+        self.assertEqual(loaded[events.Event],
+                         events.Event.objects.count())
+        self.assertEqual(loaded[entries.EntryEvent],
+                         entries.EntryEvent.objects.count())
+        loader = CopyLoader(connection)
+        entry_event = entries.EntryEvent.objects.first()
+        entry_event.pk = None
+        entry_event.task_name = None
+        entry_event.identifier = 'urn:"quoted"'
+        fields = [field for field in entries.EntryEvent._meta.concrete_fields
+                  if not field.primary_key]
+        row = loader._format_row(entry_event, fields)
+        self.assertIn('"urn:""quoted"""', row)
+        self.assertIn(',\\N', row)
+        self.assertTrue(row.endswith('\n'))
+
+    def test_pipelined_parse(self):
+        '''
+        Runs the business rules with the XML being read on a background
+        thread and makes sure errors raised while handling the events stop
+        the reader.
+        '''
+        curpath = os.path.dirname(__file__)
+        for test_file in ('data/commission.xml', 'data/nested_pack.xml'):
+            parser = BusinessEPCISParser(
+                os.path.join(curpath, test_file),
+                pipelined=True,
+                flush_policy=FlushPolicy(max_events=1)
+            )
+            parser.pipeline_batch_size = 1
+            parser.parse()
+        all_child = entries.Entry.objects.filter(
+            top_id__identifier='urn:epc:id:sgtin:305555.5555555.1'
+        )
+        self.assertEqual(all_child.count(), 12)
+        parser = BusinessEPCISParser(
+            os.path.join(curpath, 'data/commission.xml'),
+            pipelined=True
+        )
+        parser.pipeline_batch_size = 1
+        parser.pipeline_depth = 1
+        with self.assertRaises(errors.CommissioningError):
+            parser.parse()
+
     def _parse_test_data(self, test_file='data/epcis.xml',
                          parser_type=BusinessEPCISParser,
                          recursive_decommission=False,
@@ -7,6 +7,7 @@ test_quartet
 
 Tests for `quartet_epcis` models module.
 """
+import io
 import os
 import django
 import logging
@@ -20,7 +21,9 @@ from quartet_capture import models
 from quartet_capture.rules import RuleContext
 from quartet_epcis.parsing.parser import QuartetParser
 from quartet_epcis.parsing.context_parser import BusinessEPCISParser
-from quartet_epcis.parsing.json import JSONParser
+from quartet_epcis.parsing.json import JSONParser, JSONArrayReader
+from quartet_epcis.parsing.dates import parse_event_time
+from dateutil.parser import parse as parse_date
 from quartet_epcis.parsing.steps import EPCISParsingStep
 from quartet_epcis.models import events, entries, choices
 from quartet_epcis.db_api.queries import get_destinations, get_sources
@@ -142,6 +145,16 @@ class TestQuartet(TestCase):
             os.path.join(curpath, 'data/epcis.xml')
         )
 
+    def test_a_pipelined_epcis_parser(self):
+        curpath = os.path.dirname(__file__)
+        parser = QuartetParser(
+            os.path.join(curpath, 'data/epcis.xml'),
+            pipelined=True
+        )
+        parser.pipeline_batch_size = 1
+        parser.pipeline_depth = 1
+        self.run_parser(parser)
+
     def test_a_json_parser(self):
         curpath = os.path.dirname(__file__)
         parser = JSONParser(
@@ -149,6 +162,47 @@ class TestQuartet(TestCase):
         )
         parser.parse()
 
+    def test_a_streaming_json_parser(self):
+        curpath = os.path.dirname(__file__)
+        with open(os.path.join(curpath, 'data/inbound.json'), 'rb') as f:
+            parser = JSONParser(io.BytesIO(f.read()))
+        parser.chunk_size = 7
+        parser.parse()
+        self.assertEqual(events.Event.objects.count(), 4)
+
+    def test_json_parser_clears_entry_cache(self):
+        curpath = os.path.dirname(__file__)
+        parser = JSONParser(os.path.join(curpath, 'data/inbound.json'))
+        parser.parse()
+        self.assertEqual(len(parser.entry_cache), 0)
+        parser = JSONParser('{"events": []}')
+        parser.entry_cache['urn:epc:id:sgtin:305555.0555555.1'] = \
+            entries.Entry(identifier='urn:epc:id:sgtin:305555.0555555.1')
+        with self.assertRaises(JSONParser.NoEventsError):
+            parser.parse()
+        self.assertEqual(len(parser.entry_cache), 0)
+
+    def test_json_array_reader(self):
+        data = '{"header": {"events": "ignored", "n": [1.5, 2e3]},' \
+               ' "events": [{"a": "\u00e9"}, 12345, [], {}],' \
+               ' "trailer": null}'
+        for chunk_size in (1, 3, 1024):
+            reader = JSONArrayReader(io.BytesIO(data.encode()), chunk_size)
+            self.assertEqual(list(reader.iter_items('events')),
+                             [{'a': '\u00e9'}, 12345, [], {}])
+        reader = JSONArrayReader(io.StringIO('{"events": []}'))
+        self.assertEqual(list(reader.iter_items('events')), [])
+
+    def test_parse_event_time(self):
+        for value in ('2018-01-22T22:51:49.294565+00:00',
+                      '2018-01-22T22:51:49Z',
+                      '2018-01-22T17:51:49.1234567-05:00',
+                      '2018-01-22T22:51:49',
+                      'Jan 22 2018 22:51:49 UTC'):
+            self.assertEqual(parse_event_time(value), parse_date(value))
+        self.assertIs(parse_event_time('2018-01-22T22:51:49Z'),
+                      parse_event_time('2018-01-22T22:51:49Z'))
+
     def run_parser(self, parser):
         parser.parse()
         print(parser.event_cache)
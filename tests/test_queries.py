@@ -13,11 +13,20 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 import os
+import json
+from datetime import date
 import logging
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from EPCPyYes.core.SBDH.template_sbdh import StandardBusinessDocumentHeader
+from EPCPyYes.core.v1_2.template_events import TransformationEvent
 from quartet_epcis.models import events, choices, headers, entries
-from quartet_epcis.db_api import queries
+from quartet_epcis.db_api import cache, partitions, queries, writers
 from quartet_epcis.parsing.parser import QuartetParser, EPCPyYesParser
 from quartet_epcis.parsing.context_parser import BusinessEPCISParser
 
@@ -151,6 +160,180 @@ class QueriesTestCase(TestCase):
         events = qp.get_events_by_epc('urn:epc:id:sgtin:305555.0555555.1')
         self.assertEqual(len(events), 3)
 
+    def test_event_pages(self):
+        '''
+        Pages through the events for an epc and for an ILMD value one
+        event at a time.
+        '''
+        self._parse_test_data()
+        qp = queries.EPCISDBProxy()
+        for get_events, args in (
+            (qp.get_events_by_epc, {'epc': 'urn:epc:id:sgtin:305555.0555555.1'}),
+            (qp.get_events_by_ilmd, {'name': 'lotNumber', 'value': 'DL232'})
+        ):
+            expected = [event.id for event in get_events(**args)]
+            ids = []
+            page = get_events(page_size=1, **args)
+            while True:
+                self.assertEqual(len(page), 1)
+                ids.append(page[0].id)
+                if not page.next_cursor:
+                    break
+                page = get_events(page_size=1, cursor=page.next_cursor,
+                                  **args)
+            self.assertEqual(ids, expected)
+        with self.assertRaises(ValueError):
+            qp.get_events_by_ilmd('lotNumber', 'DL232', page_size=1,
+                                  cursor='bad')
+
+    def test_time_bounded_events(self):
+        '''
+        Limits the events for an epc to a time range and makes sure the
+        partition friendly prefetch builds the same events.
+        '''
+        self._parse_test_data()
+        qp = queries.EPCISDBProxy()
+        epc = 'urn:epc:id:sgtin:305555.0555555.1'
+        event_times = sorted(entries.EntryEvent.objects.filter(
+            identifier=epc).values_list('event_time', flat=True))
+        all_events = qp.get_events_by_epc(epc)
+        self.assertEqual(len(all_events), 3)
+        bounded = qp.get_events_by_epc(epc, start_time=event_times[1])
+        self.assertEqual([e.id for e in bounded],
+                         [e.id for e in all_events[1:]])
+        bounded = list(qp.iter_events_by_epc(epc, end_time=event_times[1]))
+        self.assertEqual(len(bounded), 1)
+        bounded = qp.get_events_by_epc_list([epc], start_time=event_times[0],
+                                            end_time=event_times[2])
+        self.assertEqual(len(bounded), 2)
+        with self.settings(QUARTET_EPCIS_PARTITION_EVENTS=True):
+            self.assertEqual([e.render() for e in qp.get_events_by_epc(epc)],
+                             [e.render() for e in all_events])
+
+    def test_partition_ranges(self):
+        '''
+        Partitions line up on multiples of the partition size and
+        partitioning is left alone on databases other than PostgreSQL.
+        '''
+        table = entries.EntryEvent._meta.db_table
+        self.assertEqual(
+            partitions.get_partition_ranges(date(2019, 11, 15), 3, 1),
+            [(table + '_p201911', date(2019, 11, 1), date(2019, 12, 1)),
+             (table + '_p201912', date(2019, 12, 1), date(2020, 1, 1)),
+             (table + '_p202001', date(2020, 1, 1), date(2020, 2, 1))])
+        self.assertEqual(
+            partitions.get_partition_ranges(date(2019, 11, 15), 2, 3),
+            [(table + '_p201910', date(2019, 10, 1), date(2020, 1, 1)),
+             (table + '_p202001', date(2020, 1, 1), date(2020, 4, 1))])
+        if connection.vendor != 'postgresql':
+            self.assertFalse(partitions.is_partitioned())
+            self.assertFalse(partitions.partition_table())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    def test_partition_table(self):
+        '''
+        Converts a populated entry event table, loads more events into it,
+        creates partitions ahead of time and detaches an old one.
+        '''
+        if partitions.is_partitioned():
+            self.skipTest('The table was partitioned when migrating.')
+        table = entries.EntryEvent._meta.db_table
+
+        def indexes():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+                    [table])
+                return {row[0] for row in cursor.fetchall()}
+
+        def foreign_keys():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT conname, pg_get_constraintdef(oid) "
+                    "FROM pg_constraint WHERE conrelid = %s::regclass "
+                    "AND contype = 'f'", [table])
+                return set(cursor.fetchall())
+
+        def partition_of(entry_event):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT tableoid::regclass::text FROM %s WHERE id = %%s"
+                    % table, [entry_event.id])
+                return cursor.fetchone()[0]
+
+        self._parse_test_data()
+        rows = list(entries.EntryEvent.objects.order_by('id').values_list())
+        old_indexes, old_foreign_keys = indexes(), foreign_keys()
+        self.assertTrue(old_foreign_keys)
+        self.assertTrue(partitions.partition_table())
+        self.assertTrue(partitions.is_partitioned())
+        self.assertFalse(partitions.partition_table())
+        self.assertEqual(
+            rows,
+            list(entries.EntryEvent.objects.order_by('id').values_list()))
+        self.assertEqual(indexes(), old_indexes)
+        self.assertEqual(foreign_keys(), old_foreign_keys)
+        # new rows continue the old ids
+        self._parse_test_data('data/transformation.xml')
+        new_rows = list(
+            entries.EntryEvent.objects.filter(id__gt=rows[-1][0]))
+        self.assertTrue(new_rows)
+        self.assertEqual(partition_of(new_rows[0]), table + '_p201801')
+        names = partitions.create_partitions(count=3)
+        self.assertEqual(names, partitions.create_partitions(count=3))
+        entry_event = entries.EntryEvent.objects.create(
+            event=events.Event.objects.first(), event_type='ob',
+            event_time=timezone.now(), entry=entries.Entry.objects.first(),
+            identifier='now')
+        self.assertEqual(partition_of(entry_event), names[0])
+        self.assertEqual(partitions.detach_partitions(date(2018, 2, 1)),
+                         [table + '_p201801'])
+        self.assertEqual(list(entries.EntryEvent.objects.all()),
+                         [entry_event])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM %s_p201801" % table)
+            self.assertEqual(cursor.fetchone()[0],
+                             len(rows) + len(new_rows))
+
+    def test_get_events_by_epc_list(self):
+        '''
+        Events that contain several of the epcs are only returned once.
+        '''
+        self._parse_test_data()
+        qp = queries.EPCISDBProxy()
+        epcs = ['urn:epc:id:sgtin:305555.0555555.%s' % i for i in range(1, 6)]
+        pevents = qp.get_events_by_epc_list(epcs)
+        ids = [event.id for event in pevents]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), 3)
+
+    def test_query_plans(self):
+        '''
+        Each of the hot lookups is planned using the index added for it.
+        '''
+        self._parse_test_data()
+        entry = entries.Entry.objects.all()[0]
+        plans = {
+            'entry_parent_decom_idx': entries.Entry.objects.filter(
+                parent_id__in=[entry], decommissioned=False),
+            'entry_top_decom_idx': entries.Entry.objects.filter(
+                top_id__in=[entry], decommissioned=False),
+            'entry_active_parents_idx': entries.Entry.objects.filter(
+                parent_id__in=[entry], is_parent=True, decommissioned=False),
+            'entryevent_history_idx': entries.EntryEvent.objects.filter(
+                identifier=entry.identifier).order_by('event_time',
+                                                      'event_id'),
+            'ilmd_name_value_idx':
+                events.InstanceLotMasterData.objects.filter(
+                    name='lotNumber', value='DL232'),
+        }
+        if connection.vendor == 'postgresql':
+            # the test tables are too small for the planner to bother
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for index, queryset in plans.items():
+            self.assertIn(index, queryset.explain())
+
     def test_get_transaction_event(self):
         self._parse_test_data()
         te = events.Event.objects.filter(
@@ -182,6 +365,182 @@ class QueriesTestCase(TestCase):
         self.assertEqual(len(event.ilmd), 2)
         print(event.render())
 
+    def test_get_epcis_events(self):
+        '''
+        Converting a batch of events takes one query for the events and
+        one per related table no matter how many events there are and
+        gives the same results as converting them one at a time.
+        '''
+        self._parse_test_data()
+        qp = queries.EPCISDBProxy()
+        db_events = events.Event.objects.order_by('event_time')
+        expected = [qp.get_epcis_event(db_event).render()
+                    for db_event in db_events]
+        with CaptureQueriesContext(connection) as context:
+            pevents = qp.get_epcis_events(db_events.all())
+        self.assertEqual(len(context.captured_queries),
+                         1 + len(queries.EVENT_PREFETCH) + 2)
+        self.assertEqual([event.render() for event in pevents], expected)
+
+    def test_event_cache(self):
+        '''
+        With the event cache on, events are only rebuilt from the database
+        the first time they are requested until the event data is removed.
+        '''
+        qp = queries.EPCISDBProxy()
+        for setting in ('local', 'default'):
+            self._parse_test_data()
+            event_ids = list(events.Event.objects.values_list('id', flat=True))
+            expected = [event.render() for event in
+                        qp.get_epcis_events(events.Event.objects.all())]
+            with self.settings(QUARTET_EPCIS_EVENT_CACHE=setting):
+                event_cache = cache.get_event_cache()
+                event_cache.clear()
+                qp.get_epcis_events(events.Event.objects.all())
+                with CaptureQueriesContext(connection) as context:
+                    pevents = qp.get_epcis_events(events.Event.objects.all())
+                # just the query for the events themselves
+                self.assertEqual(len(context.captured_queries), 1)
+                self.assertEqual([event.render() for event in pevents],
+                                 expected)
+                self.assertEqual(len(event_cache.get_many(event_ids)), 4)
+                call_command('remove_event_data', force='true')
+                self.assertEqual(event_cache.get_many(event_ids), {})
+
+    def test_stream_message(self):
+        '''
+        Streams a message out of the database a couple of events at a
+        time through the XML and JSON document writers.
+        '''
+        message_id = self._parse_test_data()
+        message = headers.Message.objects.get(id=message_id)
+        qp = queries.EPCISDBProxy()
+        pevents = list(qp.iter_message_events(message, chunk_size=2))
+        self.assertEqual(len(pevents), 4)
+        self.assertIsInstance(pevents[-1], TransformationEvent)
+        header = qp.get_message_header(message)
+        xml = ''.join(writers.EPCISDocumentWriter(header).write(pevents))
+        root = ElementTree.fromstring(xml)
+        event_list = root.find('EPCISBody/EventList')
+        self.assertEqual(len(event_list), 4)
+        self.assertEqual(len(event_list.find('extension')), 1)
+        self.assertIsNotNone(root.find('EPCISHeader'))
+        data = json.loads(''.join(
+            writers.EPCISJSONDocumentWriter(header).write(
+                qp.iter_message_events(message))))
+        self.assertEqual(len(data['events']), 4)
+        self.assertIn('header', data)
+        with self.assertRaises(ValueError):
+            list(writers.EPCISDocumentWriter().write(reversed(pevents)))
+
+    def test_get_aggregation_parents_by_epcs(self):
+        '''
+        The parents beneath a set of pallets are collected with one query
+        per level of the hierarchy.
+        '''
+        def create(identifier, parent=None, is_parent=True):
+            return entries.Entry.objects.create(
+                identifier=identifier, is_parent=is_parent, parent_id=parent,
+                top_id=parent and (parent.top_id or parent)
+            )
+        expected = []
+        for p in range(3):
+            pallet = create('pallet%s' % p)
+            expected.append(pallet.identifier)
+            for c in range(4):
+                case = create('case%s.%s' % (p, c), pallet)
+                expected.append(case.identifier)
+                for i in range(2):
+                    create('item%s.%s.%s' % (p, c, i), case, is_parent=False)
+        qp = queries.EPCISDBProxy()
+        with CaptureQueriesContext(connection) as context:
+            parents = qp.get_aggregation_parents_by_epcs(
+                ['pallet0', 'pallet1', 'pallet2'])
+        self.assertEqual(sorted(parents), sorted(expected))
+        # the pallets, the cases and the (empty) level below the cases
+        self.assertEqual(len(context.captured_queries), 3)
+
+    def test_propagate_to_descendants(self):
+        '''
+        Each child takes the values of its own top or nearest updated
+        parent rather than those of whichever top was updated last.
+        '''
+        def create(identifier, disposition, parent=None):
+            return entries.Entry.objects.create(
+                identifier=identifier, last_disposition=disposition,
+                is_parent=True, parent_id=parent,
+                top_id=parent and (parent.top_id or parent)
+            )
+        pallet_a, pallet_b = create('a', 'a'), create('b', 'b')
+        case_a, case_b = create('a1', None, pallet_a), create('b1', None,
+                                                               pallet_b)
+        item_a, item_b = create('a2', None, case_a), create('b2', None,
+                                                             case_b)
+        qp = queries.EPCISDBProxy()
+        fields = ['last_disposition']
+        self.assertEqual(
+            qp.update_entries_from_tops([pallet_a, pallet_b], fields), 4)
+        for entry, disposition in ((case_a, 'a'), (item_a, 'a'),
+                                   (case_b, 'b'), (item_b, 'b')):
+            entry.refresh_from_db()
+            self.assertEqual(entry.last_disposition, disposition)
+        entries.Entry.objects.filter(identifier__in=['a', 'a1']).update(
+            last_disposition='x')
+        entries.Entry.objects.filter(identifier='b').update(
+            last_disposition='y')
+        qp.propagate_to_descendants([case_a.pk, pallet_b.pk], fields)
+        values = dict(entries.Entry.objects.values_list('identifier',
+                                                        'last_disposition'))
+        self.assertEqual(values, {'a': 'x', 'a1': 'x', 'a2': 'x',
+                                  'b': 'y', 'b1': 'y', 'b2': 'y'})
+        # the same again without UPDATE ... FROM (older SQLite versions)
+        entries.Entry.objects.filter(identifier='b').update(
+            last_disposition='z')
+        with mock.patch.object(qp, '_supports_update_from',
+                               return_value=False):
+            qp.propagate_to_descendants([case_a.pk, pallet_b.pk], fields)
+        values = dict(entries.Entry.objects.values_list('identifier',
+                                                        'last_disposition'))
+        self.assertEqual(values, {'a': 'x', 'a1': 'x', 'a2': 'x',
+                                  'b': 'z', 'b1': 'z', 'b2': 'z'})
+        self.assertEqual(
+            sorted(identifier for entry_id, identifier in
+                   qp.get_descendant_entries([pallet_a.pk, case_a.pk])),
+            ['a2'])
+
+    def test_flat_decommission_closure(self):
+        '''
+        After a non-recursive decommission of a case the closure table
+        and the recursive query agree on what is left inside the pallet.
+        '''
+        def create(identifier, parent=None):
+            return entries.Entry.objects.create(
+                identifier=identifier, is_parent=True, parent_id=parent,
+                top_id=parent and (parent.top_id or parent))
+        pallet = create('pallet')
+        case_a, case_b = create('case_a', pallet), create('case_b', pallet)
+        box = create('box', case_a)
+        create('item_a', box), create('item_b', case_b)
+        qp = queries.EPCISDBProxy()
+        qp.rebuild_closure()
+        case_a.decommissioned = True
+        case_a.save()
+        qp.remove_entries_from_closure([case_a], recursive=False)
+
+        def descendants(entry):
+            return sorted(e.identifier for e in qp.get_descendants([entry]))
+        for entry in (pallet, box):
+            with self.settings(QUARTET_EPCIS_ENTRY_CLOSURE=True):
+                from_closure = descendants(entry)
+            self.assertEqual(from_closure, descendants(entry))
+        self.assertEqual(descendants(pallet), ['case_b', 'item_b'])
+        self.assertEqual(descendants(box), ['item_a'])
+        rows = set(entries.EntryClosure.objects.values_list(
+            'ancestor_id', 'descendant_id', 'depth'))
+        qp.rebuild_closure()
+        self.assertEqual(rows, set(entries.EntryClosure.objects.values_list(
+            'ancestor_id', 'descendant_id', 'depth')))
+
     def test_parse_and_cache(self, test_file='data/epcis.xml'):
         curpath = os.path.dirname(__file__)
         parser = EPCPyYesParser(
@@ -13,14 +13,22 @@
 #
 # Copyright 2018 SerialLab Corp.  All rights reserved.
 import os
+import datetime
+import gzip
 import json
+from unittest import mock
+from xml.etree import ElementTree
 from quartet_epcis.parsing.parser import QuartetParser
 from rest_framework.test import APITestCase
 from django.urls import reverse
+from django.utils import timezone
 from quartet_epcis.models import events, entries
 from quartet_epcis.management.commands.create_epcis_groups import \
     Command
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User, Group, Permission
+from quartet_masterdata.models import Company, TradeItem
+from quartet_epcis.filters import convert_barcodes, prefix_cache
+from quartet_epcis import pagination, serializers, viewsets
 
 class EPCISProxyViewTests(APITestCase):
     '''
@@ -80,6 +88,10 @@ class EPCISProxyViewTests(APITestCase):
                       kwargs={'entry_identifier': entry.identifier})
         result = self.client.get(url, format='json')
         print(result.content.decode(result.charset))
+        result = self.client.get(url, {'start_time': '2100-01-01T00:00:00'})
+        self.assertEqual(result.status_code, 404)
+        result = self.client.get(url, {'start_time': 'yesterday'})
+        self.assertEqual(result.status_code, 400)
 
     def test_get_events_by_ilmd(self):
         '''
@@ -93,6 +105,251 @@ class EPCISProxyViewTests(APITestCase):
         print(result.content.decode(result.charset))
         self.assertEqual(result.status_code, 200)
 
+    def test_get_events_by_ilmd_pages(self):
+        '''
+        Follows the next link through the events for a lot a page at a
+        time.
+        '''
+        self._parse_test_data()
+        url = reverse('events-by-ilmd',
+                      kwargs={'ilmd_name': 'lotNumber', 'ilmd_value': 'DL232'})
+        result = self.client.get(url, {'page_size': 1})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(result.data['events']), 1)
+        self.assertIn('rel="next"', result['Link'])
+        next_url = result['Link'][1:result['Link'].index('>')]
+        result = self.client.get(next_url)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(result.data['events']), 1)
+        self.assertNotIn('Link', result)
+        result = self.client.get(url, {'page_size': 1, 'cursor': 'bad'})
+        self.assertEqual(result.status_code, 400)
+
+    def test_entry_status(self):
+        '''
+        Posts a list of EPCs, one of which is unknown, and checks the
+        statuses that come back.
+        '''
+        parent = entries.Entry.objects.create(
+            identifier='urn:epc:id:sgtin:305555.3555555.1', is_parent=True)
+        child = entries.Entry.objects.create(
+            identifier='urn:epc:id:sgtin:305555.0555555.1',
+            parent_id=parent, top_id=parent,
+            last_disposition='urn:epcglobal:cbv:disp:in_progress',
+            last_event_time=datetime.datetime(
+                2018, 1, 22, 22, 51, 49, 294565, datetime.timezone.utc))
+        url = reverse('entry-status')
+        result = self.client.post(
+            url, {'epcs': [child.identifier, 'urn:epc:id:sgtin:bad']},
+            format='json')
+        self.assertEqual(result.status_code, 200)
+        statuses = json.loads(b''.join(result.streaming_content))
+        self.assertEqual(len(statuses), 2)
+        self.assertEqual(statuses[0]['identifier'], child.identifier)
+        self.assertTrue(statuses[0]['commissioned'])
+        self.assertEqual(statuses[0]['parent_id'], parent.identifier)
+        self.assertEqual(statuses[0]['top_id'], parent.identifier)
+        self.assertEqual(statuses[0]['last_disposition'],
+                         child.last_disposition)
+        self.assertEqual(statuses[0]['last_event_time'],
+                         '2018-01-22T22:51:49.294565+00:00')
+        self.assertEqual(statuses[1], {
+            'identifier': 'urn:epc:id:sgtin:bad', 'commissioned': False,
+            'decommissioned': False, 'last_disposition': None,
+            'last_event_time': None, 'parent_id': None, 'top_id': None})
+        result = self.client.post(url, {'epcs': 'bad'}, format='json')
+        self.assertEqual(result.status_code, 400)
+        with self.settings(QUARTET_EPCIS_MAX_STATUS_EPCS=1):
+            result = self.client.post(url, ['a', 'b'], format='json')
+            self.assertEqual(result.status_code, 400)
+        # the view permission is enough for a lookup
+        viewer = User.objects.create_user(username='viewer')
+        self.client.force_authenticate(user=viewer)
+        result = self.client.post(url, ['a'], format='json')
+        self.assertEqual(result.status_code, 403)
+        viewer.user_permissions.add(
+            Permission.objects.get(codename='view_entry'))
+        viewer = User.objects.get(pk=viewer.pk)
+        self.client.force_authenticate(user=viewer)
+        result = self.client.post(url, ['a'], format='json')
+        self.assertEqual(result.status_code, 200)
+
+    def test_entry_barcode_search(self):
+        '''
+        Searches for an entry by barcode and makes sure the company prefix
+        length comes from the cache after the first search.
+        '''
+        company = Company.objects.create(name='Test Company',
+                                         gs1_company_prefix='305555')
+        TradeItem.objects.create(company=company, GTIN14='03055555555557')
+        entry = entries.Entry.objects.create(
+            identifier='urn:epc:id:sgtin:305555.0555555.1234567890')
+        prefix_cache.clear()
+        url = reverse('entries-list')
+        result = self.client.get(
+            url, {'search': '0103055555555557211234567890'})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data[0]['identifier'], entry.identifier)
+        self.assertEqual(prefix_cache.misses, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                convert_barcodes(['0103055555555557211234567890', 'abc']),
+                [entry.identifier, 'abc'])
+        self.assertEqual(prefix_cache.hits, 1)
+        # unknown GTINs are searched as they are and cached as unknown
+        unknown = '0109999999999997211234567890'
+        self.assertEqual(convert_barcodes([unknown]), [unknown])
+        with self.assertNumQueries(0):
+            self.assertEqual(convert_barcodes([unknown]), [unknown])
+        result = self.client.get(url, {'search': unknown})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data, [])
+
+    def test_cursor_pagination(self):
+        '''
+        Pages through the entries and events with the count-free cursor
+        paginators.
+        '''
+        self._parse_test_data()
+        with mock.patch.object(viewsets.EntryViewSet, 'pagination_class',
+                               pagination.EntryCursorPagination):
+            url = reverse('entries-list')
+            identifiers = []
+            with self.assertNumQueries(1):
+                result = self.client.get(url, {'page_size': 2})
+            self.assertNotIn('count', result.data)
+            while url:
+                identifiers += [entry['identifier'] for entry in
+                                result.data['results']]
+                url = result.data['next']
+                if url:
+                    result = self.client.get(url)
+            self.assertEqual(
+                identifiers,
+                list(entries.Entry.objects.order_by(
+                    'created', 'id').values_list('identifier', flat=True)))
+        with mock.patch.object(viewsets.EventViewSet, 'pagination_class',
+                               pagination.EventCursorPagination):
+            result = self.client.get(reverse('events-list'), {'page_size': 3})
+            self.assertEqual(len(result.data['results']), 3)
+            self.assertIsNotNone(result.data['next'])
+
+    def test_cursor_pagination_ties(self):
+        '''
+        Pages through more rows sharing the same created and event_time
+        values than DRF's cursor offset cutoff without repeating or
+        skipping any.
+        '''
+        now = timezone.now()
+        db_event = events.Event.objects.create(event_time=now, type='ob')
+        entries.Entry.objects.bulk_create(
+            entries.Entry(identifier='urn:epc:id:sgtin:305555.0555555.%s' % i)
+            for i in range(1100))
+        entries.Entry.objects.update(created=now)
+        entries.EntryEvent.objects.bulk_create(
+            entries.EntryEvent(event=db_event, event_time=now, event_type='ob',
+                               entry=entry, identifier=entry.identifier)
+            for entry in entries.Entry.objects.all())
+        for viewset, paginator, name in (
+            (viewsets.EntryViewSet, pagination.EntryCursorPagination,
+             'entries-list'),
+            (viewsets.EntryEventViewSet, pagination.EntryEventCursorPagination,
+             'entry-events-list')
+        ):
+            with mock.patch.object(viewset, 'pagination_class', paginator):
+                url = reverse(name)
+                result = self.client.get(url, {'page_size': 500,
+                                                'fields': 'id'})
+                ids = []
+                while True:
+                    ids += [row['id'] for row in result.data['results']]
+                    if not result.data['next']:
+                        break
+                    result = self.client.get(result.data['next'])
+                self.assertEqual(len(ids), 1100)
+                self.assertEqual(len(set(ids)), 1100)
+        with mock.patch.object(viewsets.EntryViewSet, 'pagination_class',
+                               pagination.EntryCursorPagination):
+            result = self.client.get(reverse('entries-list'),
+                                     {'cursor': 'bad'})
+            self.assertEqual(result.status_code, 404)
+
+    def test_values_lists(self):
+        '''
+        Lists entries and events through the values serializers with and
+        without sparse fields and expansions.
+        '''
+        self._parse_test_data()
+        result = self.client.get(reverse('events-list'))
+        self.assertEqual(result.status_code, 200)
+        # the same output as the model serializer
+        self.assertEqual(
+            json.loads(result.content),
+            json.loads(json.dumps(serializers.EventSerializer(
+                events.Event.objects.all(), many=True).data)))
+        parent = entries.Entry.objects.create(
+            identifier='urn:epc:id:sscc:305555.1000000001', is_parent=True)
+        entries.Entry.objects.filter(
+            identifier='urn:epc:id:sgtin:305555.0555555.1').update(
+            parent_id=parent, top_id=parent)
+        url = reverse('entries-list')
+        with self.assertNumQueries(1):
+            result = self.client.get(url, {
+                'fields': 'identifier,last_disposition',
+                'expand': 'parent',
+                'search': 'urn:epc:id:sgtin:305555.0555555.1'})
+        self.assertEqual(result.data, [{
+            'identifier': 'urn:epc:id:sgtin:305555.0555555.1',
+            'last_disposition': 'urn:epcglobal:cbv:disp:in_transit',
+            'parent': parent.identifier}])
+        result = self.client.get(url, {'fields': 'identifier,bad'})
+        self.assertEqual(result.status_code, 400)
+        with mock.patch.object(viewsets.EntryEventViewSet, 'pagination_class',
+                               pagination.EntryEventCursorPagination):
+            result = self.client.get(reverse('entry-events-list'),
+                                     {'fields': 'identifier'})
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(list(result.data['results'][0]), ['identifier'])
+
+    def test_stream_message(self):
+        '''
+        Streams a full message back as XML, JSON and gzipped JSON.
+        '''
+        message_id = self._parse_test_data()
+        url = reverse('message', kwargs={'message_id': message_id})
+        result = self.client.get(url, {'stream': 'true', 'format': 'xml'})
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result.streaming)
+        root = ElementTree.fromstring(b''.join(result.streaming_content))
+        self.assertEqual(len(root.find('EPCISBody/EventList')), 4)
+        result = self.client.get(url, {'stream': 'true'})
+        content = json.loads(b''.join(result.streaming_content))
+        self.assertEqual(len(content['events']), 4)
+        self.assertIn('header', content)
+        result = self.client.get(url, {'stream': 'true'},
+                                 HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(result['Content-Encoding'], 'gzip')
+        content = json.loads(
+            gzip.decompress(b''.join(result.streaming_content)))
+        self.assertEqual(len(content['events']), 4)
+        with self.settings(QUARTET_EPCIS_STREAMING_THRESHOLD=3):
+            self.assertTrue(self.client.get(url).streaming)
+        self.assertFalse(self.client.get(url).streaming)
+
+    def test_stream_events_by_epc(self):
+        self._parse_test_data()
+        url = reverse('events-by-entry-id',
+                      kwargs={'entry_identifier':
+                              'urn:epc:id:sgtin:305555.0555555.1'})
+        result = self.client.get(url, {'stream': 'true'})
+        self.assertEqual(result.status_code, 200)
+        content = json.loads(b''.join(result.streaming_content))
+        self.assertEqual(len(content['events']), 3)
+        url = reverse('events-by-entry-id',
+                      kwargs={'entry_identifier': 'urn:epc:id:sgtin:bad'})
+        result = self.client.get(url, {'stream': 'true'})
+        self.assertEqual(result.status_code, 404)
+
     def _parse_test_data(self):
         curpath = os.path.dirname(__file__)
         parser = QuartetParser(